@@ -0,0 +1,184 @@
+'''
+artifact_cache
+Content-addressed cache for the artifacts of the mCRL2 pipeline
+
+Every stage of the pipeline is keyed by a hash of its inputs:
+    .mcrl2  image pixels and spec options (e.g. greyscale, palette, encoding, atoms)
+    .lps    .mcrl2 key and mCRL2 toolset version
+    .pbes   .lps key and translated .mcf formula
+    .npy    .mcrl2 key and translated .mcf formula, the final satisfaction mask
+The mask does not depend on the toolset version, so a restored mask needs no mCRL2 at all.
+A cached pipeline run restores the artifacts of all stages whose inputs did not
+change and only executes the tools from the first stage that did. The least
+recently used artifacts are evicted once the cache exceeds its size bound.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import filecmp
+import hashlib
+import os
+import shutil
+import numpy as np
+from PIL import Image
+
+# other scripts
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'spatial_mcrl2') # default cache location
+MAX_CACHE_SIZE = 1024 # default size bound of the cache in MB
+
+# Hash of the pixel data of an image, independent of its file format and metadata
+def hash_image(imagefile):
+    with Image.open(imagefile) as im:
+        digest = hashlib.sha256(f'{im.mode}{im.size}'.encode('utf-8'))
+        digest.update(im.tobytes())
+    return digest.hexdigest()
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Combines the keys of a stage's inputs into the key of the stage
+def stage_key(stage, *inputs):
+    return hashlib.sha256('\n'.join([stage, *map(str, inputs)]).encode('utf-8')).hexdigest()
+
+# Directory of cached artifacts with least recently used eviction
+class Artifact_Cache:
+    def __init__(self, directory = CACHE_DIR, max_size = MAX_CACHE_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size * 1024 * 1024 # bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    # copy a cached artifact to the destination, unless an identical file is already there
+    # returns whether the artifact was cached
+    def fetch(self, key, extension, destination):
+        cached = self.path(key, extension)
+        if not os.path.exists(cached):
+            return False
+        os.utime(cached) # mark as recently used
+        if not (os.path.exists(destination) and filecmp.cmp(cached, destination, shallow=False)):
+            shutil.copyfile(cached, destination)
+        return True
+
+    # copy an artifact into the cache, written to a temporary file first so readers never see partial files
+    def store(self, key, extension, source):
+        cached = self.path(key, extension)
+        shutil.copyfile(source, cached + '.tmp')
+        os.replace(cached + '.tmp', cached)
+        self.evict()
+
+    def fetch_mask(self, key):
+        cached = self.path(key, '.npy')
+        if not os.path.exists(cached):
+            return None
+        os.utime(cached)
+        return np.load(cached)
+
+    def store_mask(self, key, mask):
+        cached = self.path(key, '.npy')
+        with open(cached + '.tmp', 'wb') as f:
+            np.save(f, mask)
+        os.replace(cached + '.tmp', cached)
+        self.evict()
+
+    # remove least recently used artifacts until the cache fits its size bound
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(path)
+            total_size -= size
+
+# Runs the mCRL2 pipeline, restoring every stage whose inputs are unchanged from the cache
+def do_cached_pbessolve(imagefile, SLCSformula, greyscale, cache, palette = False, encoding = 'list', atoms = False, optimize = False):
+    predicates, propositions = native_image.precompute_atomic_predicates(imagefile, SLCSformula, greyscale) if atoms else ([], None)
+    with pbessolve_image.Toolchain_Run() as run: # the artifacts are copied out of and into a scratch directory of this run only
+        mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates, optimize, os.path.join(run.directory, os.path.basename(SLCSformula)[:-5])) # cheap, needed to key the formula
+        basefile = os.path.join(run.directory, os.path.basename(imagefile).rsplit('.', 1)[0])
+        mcrl2file = basefile + '.mcrl2'
+        lpsfile = basefile + '.lps'
+        pbesfile = basefile + '.pbes'
+
+        spec_key = stage_key('mcrl2', hash_image(imagefile), greyscale, palette, encoding, [slcs2modalmu.proposition_key(tree) for tree in predicates])
+        mask_key = stage_key('mask', spec_key, hash_file(mcffile))
+
+        mask = cache.fetch_mask(mask_key)
+        if mask is not None:
+            print(f'[artifact_cache]    restored satisfaction mask of {imagefile} and {mcffile} from cache')
+            return native_image.mask_to_coords(mask)
+
+        lps_key = stage_key('lps', spec_key, pbessolve_image.toolset_version()) # starts mcrl22lps, so only once the mask misses
+        pbes_key = stage_key('pbes', lps_key, hash_file(mcffile))
+
+        if cache.fetch(spec_key, '.mcrl2', mcrl2file):
+            print(f'[artifact_cache]    restored {mcrl2file} from cache')
+        else:
+            mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale, palette, encoding, propositions, basefile = basefile)
+            cache.store(spec_key, '.mcrl2', mcrl2file)
+
+        if cache.fetch(lps_key, '.lps', lpsfile):
+            print(f'[artifact_cache]    restored {lpsfile} from cache')
+        else:
+            pbessolve_image.run_mcrl22lps(mcrl2file, lpsfile)
+            cache.store(lps_key, '.lps', lpsfile)
+
+        if cache.fetch(pbes_key, '.pbes', pbesfile):
+            print(f'[artifact_cache]    restored {pbesfile} from cache')
+        else:
+            pbessolve_image.run_lps2pbes(lpsfile, mcffile, pbesfile)
+            cache.store(pbes_key, '.pbes', pbesfile)
+
+        parsed_equations = pbessolve_image.parse_pbessolve_output(lpsfile, pbesfile) # every tool raises on failure, before anything is stored
+        true_coords = pbessolve_image.extract_solutions(parsed_equations)
+        with Image.open(imagefile) as im:
+            width, height = im.size
+        cache.store_mask(mask_key, native_image.coords_to_mask(true_coords, (height, width)))
+
+        print(f'[artifact_cache]    pixel coordinates that satisfy {mcffile}: {image_output.describe_coords(true_coords)}')
+
+        return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the image", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the image, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python and report them as actions in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    parser.add_argument("--cachedir", help = "directory of the artifact cache", default = CACHE_DIR)
+    parser.add_argument("--cachesize", help = "size bound of the artifact cache in MB", type = int, default = MAX_CACHE_SIZE)
+    args = parser.parse_args()
+
+    cache = Artifact_Cache(args.cachedir, args.cachesize)
+    true_coords = do_cached_pbessolve(args.image, args.slcsformula, args.greyscale, cache, args.palette, args.encoding, args.atoms, args.optimize)
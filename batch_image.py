@@ -0,0 +1,133 @@
+'''
+batch_image
+Verifies many SLCS formulae on a single image
+
+The .mcrl2 specification and .lps of the image are built only once. Every formula
+is then translated, converted to a .pbes by lps2pbes and solved by pbessolve in its
+own temporary directory, and the formulae are processed concurrently by a pool of
+worker processes. One marked image is saved per formula, next to the image, as well
+as a summary of all formulae in [PATH_IMG]_summary.csv.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import csv
+import os
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+
+# other scripts
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import pgsolve_image
+import slcs2modalmu
+
+MARK_COLOUR = (144, 238, 144) # default colour of the pixels that satisfy a formula
+ENGINES = ['mcrl2', 'pgsolver'] # solvers of the .pbes of a single formula
+
+# Collects the distinct atomic propositions of all formulae
+def collect_batch_predicates(SLCSformulas, greyscale):
+    predicates = {}
+    for SLCSformula in SLCSformulas:
+        SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+        for predicate in slcs2modalmu.collect_atomic_predicates(SLCS_Ast):
+            predicates.setdefault(slcs2modalmu.proposition_key(predicate), predicate)
+    return list(predicates.values())
+
+# Translates and solves a single formula on the shared .lps, in a temporary directory of its own
+# returns the pixel coordinates that satisfy the formula and the elapsed time in seconds
+def solve_formula(lpsfile, SLCSformula, greyscale, predicates, optimize, engine):
+    start_time = timeit.default_timer()
+    with tempfile.TemporaryDirectory() as directory:
+        basefile = os.path.join(directory, os.path.basename(SLCSformula)[:-5])
+        mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates, optimize, basefile)
+        pbesfile = pbessolve_image.run_lps2pbes(lpsfile, mcffile, basefile + '.pbes')
+        if engine == 'pgsolver':
+            true_coords = pgsolve_image.solve_pbes(pbesfile)
+        else:
+            parsed_equations = pbessolve_image.parse_pbessolve_output(lpsfile, pbesfile)
+            true_coords = pbessolve_image.extract_solutions(parsed_equations)
+    return true_coords, timeit.default_timer() - start_time
+
+# Saves the image with the given pixels marked as [PATH_IMG]_[FORMULA].png
+def save_marked_image(imagefile, SLCSformula, true_coords, mark_colour = MARK_COLOUR):
+    base_imagefile = imagefile.rsplit('.', 1)[0] # only remove extension from image
+    base_slcsfile = os.path.basename(SLCSformula).rsplit('.', 1)[0] # extract only name from slcs file
+    marked_imagefile = f'{base_imagefile}_{base_slcsfile}.png'
+    with Image.open(imagefile) as im:
+        mask = native_image.coords_to_mask(true_coords, (im.height, im.width))
+        image_output.mark_image(im, mask, mark_colour).save(marked_imagefile, 'PNG')
+    return marked_imagefile
+
+def do_batch(imagefile, SLCSformulas, greyscale, workers = None, engine = 'mcrl2', palette = False, encoding = 'list', atoms = False, optimize = False, mark_colour = MARK_COLOUR):
+    # the specification and .lps are shared by all formulae
+    predicates = collect_batch_predicates(SLCSformulas, greyscale) if atoms else None
+    propositions = native_image.proposition_masks(imagefile, predicates, greyscale) if atoms else None
+    mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale, palette, encoding, propositions)
+    lpsfile = pbessolve_image.run_mcrl22lps(mcrl2file, mcrl2file.rsplit('.', 1)[0] + '.lps')
+
+    results = {}
+    summary = []
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(solve_formula, lpsfile, SLCSformula, greyscale, predicates, optimize, engine): SLCSformula
+                   for SLCSformula in SLCSformulas}
+        for future in as_completed(futures): # handle formulae in order of completion
+            SLCSformula = futures[future]
+            true_coords, elapsed = future.result()
+            marked_imagefile = save_marked_image(imagefile, SLCSformula, true_coords, mark_colour)
+            print(f'[batch_image]    {SLCSformula}: {len(true_coords)} pixels satisfy the formula, saved marked image to {marked_imagefile} ({elapsed:.2f} seconds)')
+            results[SLCSformula] = true_coords
+            summary.append((SLCSformula, len(true_coords), f'{elapsed:.3f}', marked_imagefile))
+
+    summaryfile = imagefile.rsplit('.', 1)[0] + '_summary.csv'
+    with open(summaryfile, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['formula', 'satisfying pixels', 'seconds', 'marked image'])
+        writer.writerows(sorted(summary))
+
+    print(f'\n*** successfully verified {len(SLCSformulas)} formulae, saved summary to {summaryfile} ***')
+
+    return results
+
+# Expands directories to the .slcs files they contain
+def expand_formulas(paths):
+    SLCSformulas = []
+    for path in paths:
+        if os.path.isdir(path):
+            SLCSformulas.extend(sorted(os.path.join(path, file) for file in os.listdir(path) if file.endswith('.slcs')))
+        elif path.endswith('.slcs'):
+            SLCSformulas.append(path)
+        else:
+            raise argparse.ArgumentTypeError(f'incorrect extension of {path}, expected .slcs or a directory')
+    return SLCSformulas
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformulas", help = "the spatial logic formulae, .slcs files or directories containing them", nargs = '+')
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--markcolour", help = "set a custom mark colour with three integers representing its RGB value", nargs=3, type=int, default = MARK_COLOUR)
+    parser.add_argument("--workers", help = "amount of formulae solved in parallel, defaults to the amount of processors", type = int)
+    parser.add_argument("--engine", help = "solve every .pbes with pbessolve or with the Python parity game solver", choices = ENGINES, default = 'mcrl2')
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the image", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the image in the mcrl2 specification, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--atoms", help = "evaluate the atomic propositions of all formulae in Python and report them as actions ap_i in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formulae before translating them", action = "store_true")
+    parser.add_argument("--nocoords", help = "print only the amount of satisfying pixels instead of their coordinates", action = "store_true")
+    args = parser.parse_args()
+
+    if args.nocoords:
+        image_output.PRINT_COORDS = False
+
+    results = do_batch(args.image, expand_formulas(args.slcsformulas), args.greyscale, args.workers, args.engine, args.palette, args.encoding, args.atoms, args.optimize, tuple(args.markcolour))
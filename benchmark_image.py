@@ -0,0 +1,275 @@
+'''
+benchmark_image
+Reproducible scaling benchmark of the verification pipeline
+
+Synthetic images are generated from a seed, so every run checks the same inputs: a sweep
+of sizes (e.g. 32 to 2048 pixels), a given amount of colours and blobs nested up to a given
+depth, so that S has regions to enclose. Every image is checked against families of
+formulae that grow with a level: N nested level times, S nested level times and a
+disjunction of level + 1 atomic propositions. Every stage of every case is recorded by
+stage_profiler (wall time, CPU time, memory of the mCRL2 tools and, with --memory, the
+traced memory of this process), and the results are compared against a stored baseline.
+
+The replay mode feeds recorded pbessolve --debug logs (see pbessolve_image --printoutput),
+or synthetic logs of a given size, into the pbessolve output parser and the extraction of
+the solutions, so parsing can be benchmarked on machines without the mCRL2 toolset.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+# other scripts
+import image2mcrl2
+import native_image
+import pbessolve_image
+import pgsolve_image
+import slcs2modalmu
+import stage_profiler
+
+SIZES = [32, 64, 128, 256] # default widths and heights of the synthetic images
+FAMILIES = ['near', 'bounded', 'surround', 'or'] # formula families, see family_formula
+LEVELS = [1, 2, 4] # default levels of every formula family
+ENGINES = ['mcrl2', 'pgsolver', 'native']
+WORKDIR = 'benchmark' # directory of the generated images, formulae and tool output
+BASELINE = 'benchmark_baseline.json'
+TOLERANCE = 0.25 # relative slowdown of a stage reported as regression
+MIN_DIFFERENCE = 0.01 # stages that slow down less than this amount of seconds are not reported
+
+# Grey value of every colour of the synthetic images, from black to white
+def palette(colours):
+    if colours < 2:
+        raise ValueError('synthetic images need at least 2 colours')
+    return [round(colour * 255 / (colours - 1)) for colour in range(colours)]
+
+# Generates a square RGB image with blobs nested up to the given depth
+# the background has colour 0, a blob at nesting level l has colour l modulo the amount of colours
+def generate_image(size, colours, depth, seed = 0):
+    rng = np.random.default_rng(seed)
+    indices = np.zeros((size, size), dtype=np.int64)
+
+    def blob(cy, cx, radius, level):
+        if level > depth or radius < 2:
+            return
+        y0, y1, x0, x1 = max(cy - radius, 0), min(cy + radius + 1, size), max(cx - radius, 0), min(cx + radius + 1, size)
+        ys, xs = np.ogrid[y0:y1, x0:x1]
+        disk = (ys - cy) ** 2 + (xs - cx) ** 2 <= radius ** 2
+        indices[y0:y1, x0:x1][disk] = level % colours
+        for _ in range(2): # two children within the inner half of the blob
+            offset = rng.integers(-radius // 4, radius // 4 + 1, 2)
+            blob(cy + offset[0], cx + offset[1], radius // 3, level + 1)
+
+    cells = max(size // 128, 1) # one tree of blobs per cell of at most 128 x 128 pixels
+    cell = size // cells
+    for row in range(cells):
+        for column in range(cells):
+            blob(row * cell + cell // 2, column * cell + cell // 2, cell * 2 // 5, 1)
+
+    grey = np.array(palette(colours), dtype=np.uint8)[indices]
+    return Image.fromarray(np.stack([grey] * 3, axis=-1), 'RGB')
+
+# Atomic proposition of the i-th colour of the palette, cycling through the colours
+def colour_atom(index, colours, greyscale):
+    value = palette(colours)[index % colours]
+    return f'[{value}-{value}]' if greyscale else f'[{value}-{value},{value}-{value},{value}-{value}]'
+
+# SLCS formula of a family at the given level
+def family_formula(family, level, colours, greyscale):
+    atom = lambda index: colour_atom(index, colours, greyscale)
+    if family == 'near': # N nested level times
+        return 'N (' * level + atom(1) + ')' * level
+    if family == 'bounded': # N^level, equivalent to the near family
+        return f'N^{level} ' + atom(1)
+    if family == 'surround': # phi_0 S (phi_1 S (... phi_level))
+        return ''.join(f'{atom(index)} S (' for index in range(level)) + atom(level) + ')' * level
+    if family == 'or': # disjunction of level + 1 propositions
+        return ''.join(f'{atom(index)} || (' for index in range(level)) + atom(level) + ')' * level
+    raise ValueError(f'unknown formula family {family}')
+
+# Writes the synthetic images and formulae to the working directory
+# returns the image files and the (family, level, slcs file) triples
+def generate_inputs(workdir, sizes, colours, depth, families, levels, greyscale, seed = 0):
+    os.makedirs(workdir, exist_ok=True)
+    imagefiles = []
+    for size in sizes:
+        imagefile = os.path.join(workdir, f'synthetic_{size}_{colours}c_{depth}d_{seed}s.png')
+        if not os.path.exists(imagefile): # generation is deterministic, reuse earlier images
+            generate_image(size, colours, depth, seed).save(imagefile, 'PNG')
+        imagefiles.append(imagefile)
+    formulas = []
+    for family in families:
+        for level in levels:
+            slcsfile = os.path.join(workdir, f'{family}{level}{"_grey" if greyscale else ""}.slcs')
+            with open(slcsfile, 'w') as file:
+                file.write(family_formula(family, level, colours, greyscale))
+            formulas.append((family, level, slcsfile))
+    return imagefiles, formulas
+
+# Verifies a formula on an image with the given engine, mirroring verify_image
+# returns the amount of satisfying pixels
+def verify_case(imagefile, slcsfile, greyscale, engine, atoms):
+    if engine == 'native':
+        SLCS_Ast = slcs2modalmu.parse_SLCS_formula(slcsfile, greyscale, True)
+        with stage_profiler.stage('native evaluation'):
+            mask = native_image.evaluate_tree(SLCS_Ast, native_image.load_pixels(imagefile, greyscale))
+        return int(np.count_nonzero(mask))
+    predicates, propositions = native_image.precompute_atomic_predicates(imagefile, slcsfile, greyscale) if atoms else (None, None)
+    mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale, False, 'list', propositions)
+    mcffile = slcs2modalmu.translate_SLCS_formula(slcsfile, greyscale, True, predicates)
+    if engine == 'pgsolver':
+        return len(pgsolve_image.do_pgsolve(mcrl2file, mcffile))
+    return len(pbessolve_image.do_pbessolve(mcrl2file, mcffile))
+
+# Runs a case with a fresh profiler, the output of the scripts is suppressed
+def profile_case(name, function, *args):
+    stage_profiler.ACTIVE = stage_profiler.Stage_Profiler()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), stage_profiler.stage('total'):
+            result = function(*args)
+    finally:
+        profiler, stage_profiler.ACTIVE = stage_profiler.ACTIVE, None
+    return {'case': name, 'result': result, 'stages': profiler.stages}
+
+def run_benchmark(imagefiles, formulas, greyscale, engines, atoms, repeat):
+    results = []
+    for imagefile in imagefiles:
+        for family, level, slcsfile in formulas:
+            for engine in engines:
+                for run in range(repeat):
+                    name = f'{os.path.basename(imagefile).rsplit(".", 1)[0]}/{family}{level}/{engine}{"+atoms" if atoms else ""}'
+                    result = profile_case(name, verify_case, imagefile, slcsfile, greyscale, engine, atoms)
+                    result['run'] = run
+                    report(result)
+                    results.append(result)
+    return results
+
+# Writes a synthetic pbessolve debug log for an image of the given size
+# every pixel has a target vertex X0(x, y) and an auxiliary vertex whose decoration is resolved by the strategy
+def write_synthetic_log(logfile, width, height, seed = 0):
+    rng = np.random.default_rng(seed)
+    values = rng.random(width * height) < 0.5
+    with open(logfile, 'w') as file:
+        file.write('--- solve_recursive_extended input ---\n')
+        for pixel in range(width * height):
+            y, x = divmod(pixel, width)
+            file.write(f'{2 * pixel} vertex(formula = X0({x}, {y}), decoration = none)\n')
+            file.write(f'{2 * pixel + 1} vertex(formula = X1({x}, {y}), decoration = {"true" if values[pixel] else "false"})\n')
+        for pixel in range(width * height):
+            file.write(f'set tau[{2 * pixel}] = {2 * pixel + 1}\n')
+        for start in range(0, width * height, width): # one W0/W1 update per row
+            rows = range(start, min(start + width, width * height))
+            file.write(f'W0 = {{{", ".join(str(2 * pixel + 1) for pixel in rows if values[pixel])}}}\n')
+            file.write(f'W1 = {{{", ".join(str(2 * pixel + 1) for pixel in rows if not values[pixel])}}}\n')
+        file.write('Extracting evidence...\n')
+    return logfile
+
+# Parses a recorded pbessolve debug log like parse_pbessolve_output does with the output of pbessolve
+# returns the amount of satisfying pixels
+def replay_log(logfile):
+    with stage_profiler.stage('pbessolve replay', logfile), open(logfile, 'rb') as stream:
+        equations = pbessolve_image.parse_pbessolve_stream(stream)
+    with stage_profiler.stage('output parsing'):
+        true_coords = pbessolve_image.extract_solutions(equations)
+    return len(true_coords)
+
+def run_replay(logfiles, repeat):
+    results = []
+    for logfile in logfiles:
+        for run in range(repeat):
+            result = profile_case(f'replay/{os.path.basename(logfile)}', replay_log, logfile)
+            result['run'] = run
+            report(result)
+            results.append(result)
+    return results
+
+def report(result):
+    stages = ', '.join(f'{record["stage"]} {record["wall_time"]:.3f}s' for record in result['stages'])
+    print(f'[benchmark_image]    {result["case"]}: {result["result"]} pixels, {stages}')
+
+# Fastest wall time of every (case, stage) pair over the repeated runs
+def best_times(results):
+    times = {}
+    for result in results:
+        for record in result['stages']:
+            key = (result['case'], record['stage'])
+            times[key] = min(times.get(key, float('inf')), record['wall_time'])
+    return times
+
+# Stages that became slower than the baseline by more than the tolerance
+# returns (case, stage, baseline time, time) tuples
+def compare_baseline(results, baseline, tolerance = TOLERANCE):
+    current, previous = best_times(results), best_times(baseline)
+    regressions = []
+    for key, time in current.items():
+        if key in previous and time > previous[key] * (1 + tolerance) and time - previous[key] > MIN_DIFFERENCE:
+            regressions.append((*key, previous[key], time))
+    return regressions
+
+def save_results(results, outputfile):
+    with open(outputfile, 'w') as file:
+        json.dump({'python': sys.version.split()[0], 'results': results}, file, indent=4)
+
+def load_results(outputfile):
+    with open(outputfile) as file:
+        return json.load(file)['results']
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", help = "widths and heights of the synthetic images", nargs = '+', type = int, default = SIZES)
+    parser.add_argument("--colours", help = "amount of colours of the synthetic images", type = int, default = 4)
+    parser.add_argument("--depth", help = "nesting depth of the blobs in the synthetic images", type = int, default = 3)
+    parser.add_argument("--seed", help = "seed of the synthetic images", type = int, default = 0)
+    parser.add_argument("--families", help = "formula families", nargs = '+', choices = FAMILIES, default = FAMILIES)
+    parser.add_argument("--levels", help = "levels of every formula family, e.g. the nesting depth of N", nargs = '+', type = int, default = LEVELS)
+    parser.add_argument("--engines", help = "engines to benchmark", nargs = '+', choices = ENGINES, default = ['native'])
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python, see verify_image", action = "store_true")
+    parser.add_argument("--repeat", help = "amount of runs of every case, the fastest run is compared", type = int, default = 1)
+    parser.add_argument("--memory", help = "trace the memory allocated by Python during every stage (slows down the stages)", action = "store_true")
+    parser.add_argument("--replay", help = "parse recorded pbessolve debug logs instead of running the pipeline", nargs = '+')
+    parser.add_argument("--synthlog", help = "replay synthetic pbessolve debug logs of the given sizes", nargs = '+', type = int)
+    parser.add_argument("--workdir", help = "directory of the generated inputs and tool output", default = WORKDIR)
+    parser.add_argument("--output", help = "file to save the results to, in .json format, defaults to benchmark_results.json in the working directory")
+    parser.add_argument("--baseline", help = "results to compare against, in .json format", default = BASELINE)
+    parser.add_argument("--savebaseline", help = "save the results as new baseline", action = "store_true")
+    parser.add_argument("--tolerance", help = "relative slowdown of a stage that is reported as regression", type = float, default = TOLERANCE)
+    args = parser.parse_args()
+    if args.colours < 2:
+        parser.error('--colours must be at least 2')
+    if args.output is None:
+        args.output = os.path.join(args.workdir, 'benchmark_results.json')
+
+    if args.memory:
+        tracemalloc.start()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    if args.replay or args.synthlog:
+        logfiles = list(args.replay or [])
+        for size in args.synthlog or []:
+            logfiles.append(write_synthetic_log(os.path.join(args.workdir, f'synthetic_{size}.pbes.output.txt'), size, size, args.seed))
+        results = run_replay(logfiles, args.repeat)
+    else:
+        imagefiles, formulas = generate_inputs(args.workdir, args.sizes, args.colours, args.depth, args.families, args.levels, args.greyscale, args.seed)
+        results = run_benchmark(imagefiles, formulas, args.greyscale, args.engines, args.atoms, args.repeat)
+
+    save_results(results, args.output)
+    print(f'[benchmark_image]    saved results to {args.output}')
+
+    if args.savebaseline:
+        save_results(results, args.baseline)
+        print(f'[benchmark_image]    saved results as baseline to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        regressions = compare_baseline(results, load_results(args.baseline), args.tolerance)
+        for case, stage, previous, time in regressions:
+            print(f'[benchmark_image]    regression in {case}, {stage}: {previous:.3f}s -> {time:.3f}s')
+        print(f'[benchmark_image]    {len(regressions)} regressions compared to {args.baseline}')
+        if regressions:
+            sys.exit(1)
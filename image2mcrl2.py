@@ -6,87 +6,405 @@ For input arguments, see also the help file invoked by setting the -h flag.
 '''
 import argparse
 import io
-from PIL import Image
+import numpy as np
+
+import image_output
+import native_image
+import stage_profiler
 
 GREYSCALE = False # default for optimization monochromatic images
+PALETTE = False # default for emitting pixels as indices into the colour palette of the image
+ENCODING = 'list' # data structure holding the image, see ENCODINGS
+ENCODINGS = {
+    'list': 'nested list, lookup image.y.x traverses y rows and x pixels',
+    'rows': 'one equation per row, lookup row(y).x only traverses x pixels',
+    'map':  'one pattern-matched equation per pixel, lookup pixel(x, y)',
+    'tree': 'balanced binary tree, lookup at(image, i, h) descends log2(width * height) levels',
+}
+
+# mCRL2 literal of a single pixel value
+def pixel_literal(pixel):
+    # write RGB values of current pixel: 0 = red, 1 = green, 2 = blue
+    # only one value for monochromatic images
+    if GREYSCALE:
+        return f'{pixel[0]}'
+    else:
+        return f'RGB({pixel[0]},{pixel[1]},{pixel[2]})'
+
+# builds the colour palette of the image, ordered by frequency
+# returns the distinct pixel values and the palette index of every pixel
+def build_palette(pixels):
+    colours, indices, counts = np.unique(pixels.reshape(-1, pixels.shape[-1]), axis=0, return_inverse=True, return_counts=True)
+    order = np.argsort(-counts, kind='stable') # most frequent colours get the smallest indices
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return colours[order], rank[indices.ravel()].reshape(pixels.shape[:-1])
+
+# writes the RGB data structure as mCRL2 string to a file, row by row
+def write_image_grid(values, file):
+    file.write('image = ')
+    write_grid(values, file)
+    file.write(';')
+
+# writes a nested list of rows as mCRL2 string to a file
+def write_grid(values, file):
+    file.write('[\n   [') # write start of string
+    for y, row in enumerate(values):
+        if y != 0: # handle new row
+            file.write(f'], \n   [')
+        file.write(', '.join(row))
+    file.write(f']\n]') # handle last row
+
+# writes a stack of images as a list of nested lists, image by image
+def write_image_stack(images, file):
+    file.write('image = [\n')
+    for i, values in enumerate(images):
+        if i != 0:
+            file.write(',\n')
+        write_grid(values, file)
+    file.write('\n];')
+
+# rows of mCRL2 literals of the pixels of an image, generated lazily
+def pixel_rows(pixels):
+    for row in pixels:
+        yield [pixel_literal(pixel) for pixel in row.tolist()]
+
+# rows of palette indices of the pixels of an image, generated lazily
+def index_rows(indices):
+    for row in indices:
+        yield [f'{index}' for index in row.tolist()]
+
+# loads the pixel values of a stack of images of equal dimensions, as an array of shape (images, height, width, channels)
+def load_stack(imagefiles):
+    stack = [native_image.load_pixels(imagefile, GREYSCALE) for imagefile in imagefiles]
+    if any(pixels.shape != stack[0].shape for pixels in stack):
+        raise ValueError(f'images of a stack must have equal dimensions: {", ".join(imagefiles)}')
+    return np.stack(stack)
 
 # builds the RGB data structure as mCRL2 string, from image data
 def build_image_grid(imagefile):
     output = io.StringIO() # create new string builder
-    output.write('image = [\n   [') # write start of string
+    pixels = native_image.load_pixels(imagefile, GREYSCALE)
+    write_image_grid(pixel_rows(pixels), output)
+    result = output.getvalue() # retrieve string from memory buffer
+    output.close() # discard the memory buffer
+    return result
 
-    im = Image.open(imagefile) # prepare the image
-    width, height = im.size
-    RGB_data = list(im.getdata()) # Extract RGB values as list of triples (R, G, B)
-    im.close() # close the image
-    
-    size = width * height # total amount of pixels
-    counter = 0 # holds current pixel index
-    for pixel in RGB_data:
-        # write RGB values of current pixel: 0 = red, 1 = green, 2 = blue
-        # only one value for monochromatic images
-        if GREYSCALE:
-            output.write(f'{pixel[0]}')
+# writes one equation per row of the image
+# images of a stack are distinguished by their index as first argument
+def write_image_rows(values, file, index = None):
+    prefix = '' if index is None else f'{index}, '
+    for y, row in enumerate(values):
+        file.write(f'''
+    row({prefix}{y}) = [{', '.join(row)}];''')
+
+# writes one equation per pixel of the image
+def write_image_map(values, file, index = None):
+    prefix = '' if index is None else f'{index}, '
+    for y, row in enumerate(values):
+        for x, value in enumerate(row):
+            file.write(f'''
+    pixel({prefix}{x}, {y}) = {value};''')
+
+# writes the pixels as balanced binary tree over the row-major pixel index
+# the tree is padded with copies of the last pixel to a power of two leaves
+def write_image_tree(literals, file):
+    leaves = 1
+    while leaves < len(literals):
+        leaves *= 2
+    def write_subtree(low, high): # subtree covering leaves [low, high)
+        if high - low == 1:
+            file.write(f'leaf({literals[min(low, len(literals) - 1)]})')
         else:
-            output.write(f'RGB({pixel[0]},{pixel[1]},{pixel[2]})')
+            middle = (low + high) // 2
+            file.write('node(')
+            write_subtree(low, middle)
+            file.write(', ')
+            write_subtree(middle, high)
+            file.write(')')
+    file.write('image = ')
+    write_subtree(0, leaves)
+    file.write(';')
+    return leaves // 2 # index of the first leaf of the right subtree
 
-        if counter == size - 1: # handle last pixel
-            output.write(f']\n];')
-        elif counter % width == width - 1: # handle new row
-            output.write(f'], \n   [')
-        else: # otherwise standard separator
-            output.write(f', ')
-        counter += 1
+# mCRL2 expression looking up the value of pixel (x, y), of image i for a stack of images of the given height
+def pixel_lookup(width, half, palette, height = None):
+    stack = height is not None
+    if ENCODING == 'rows':
+        lookup = 'row(i, y).x' if stack else 'row(y).x'
+    elif ENCODING == 'map':
+        lookup = 'pixel(i, x, y)' if stack else 'pixel(x, y)'
+    elif ENCODING == 'tree':
+        lookup = f'at(image, (i * {height} + y) * {width} + x, {half})' if stack else f'at(image, y * {width} + x, {half})'
+    else:
+        lookup = 'image.i.y.x' if stack else 'image.y.x'
+    return f'palette({lookup})' if palette else lookup
 
-    result = output.getvalue() # retrieve string from memory buffer
-    output.close() # discard the memory buffer
-    return result
+# groups pixels by the valuation of the precomputed propositions
+# returns the distinct valuations (one row of booleans per class) and the class index of every pixel
+def build_proposition_classes(propositions):
+    return build_palette(np.stack(propositions, axis=-1))
 
-# builds the .mcrl2 file
-def build_mCRL2_spec(imagefile):
-    result = '' 
-    result += f'''sort
-	Grid = List(List(Pixel));\n'''
-    if GREYSCALE: # different structure for monochromatic images
-        result += f'''\tPixel = Int;\n'''
+# writes the .mcrl2 specification to a file, streaming the image row by row
+# if propositions (a list of boolean masks) are given, pixels report actions ap_0, ap_1, ... instead of their value
+# if imagefile is a list of images (or the masks have shape (images, height, width)), the specification holds the
+# whole stack: image index i is an extra process parameter, fixed by a start action from an initial state i = size_i + 1
+# if roi (a boolean mask of a single image) is given, the initial state x = size_x + 1 only has start transitions to its pixels
+def write_mCRL2_spec(imagefile, file, propositions = None, roi = None):
+    if propositions:
+        shape = propositions[0].shape
+        classes, indices = build_proposition_classes(propositions)
+        values, value_rows = indices, index_rows
+    else:
+        pixels = native_image.load_pixels(imagefile, GREYSCALE) if isinstance(imagefile, str) else load_stack(imagefile)
+        shape = pixels.shape[:-1]
+        if PALETTE:
+            palette, indices = build_palette(pixels)
+            values, value_rows = indices, index_rows
+        else:
+            values, value_rows = pixels, pixel_rows
+    height, width = shape[-2:]
+    stack = len(shape) == 3
+    if stack:
+        images = [value_rows(image) for image in values]
     else:
-        result += f'''\tPixel = struct RGB(
+        rows = value_rows(values)
+    value_sort = 'Nat' if PALETTE or propositions else 'Pixel'
+
+    sorts = []
+    if ENCODING == 'list':
+        sorts.append(f'''\tGrid = List(List({'List(' if stack else ''}{value_sort}{')' if stack else ''}));\n''')
+    elif ENCODING == 'tree':
+        sorts.append(f'''\tTree = struct leaf({value_sort}) | node(Tree, Tree);\n''')
+    if GREYSCALE and not propositions: # different structure for monochromatic images
+        sorts.append(f'''\tPixel = Int;\n''')
+    elif not propositions: # pixel values are not needed in the model if propositions are given
+        sorts.append(f'''\tPixel = struct RGB(
 		    red:Intensity,
 		    green:Intensity,
 		    blue:Intensity
 	    ); 
-	    \tIntensity = Int;\n'''
+	    \tIntensity = Int;\n''')
+    if sorts:
+        file.write(f'''sort\n{''.join(sorts)}''')
     
-    result += f'''\nmap
-	image: Grid;
+    file.write(f'''\nmap''')
+    arguments = 'Nat # ' if stack else '' # image index
+    if ENCODING == 'rows':
+        file.write(f'''
+	row: {arguments}Nat -> List({value_sort});''')
+    elif ENCODING == 'map':
+        file.write(f'''
+	pixel: {arguments}Nat # Nat -> {value_sort};''')
+    elif ENCODING == 'tree':
+        file.write(f'''
+	image: Tree;
+	at: Tree # Nat # Nat -> {value_sort};''')
+    else:
+        file.write(f'''
+	image: Grid;''')
+    if propositions:
+        file.write(f'''
+	holds: Nat # Nat -> Bool;''')
+    elif PALETTE:
+        file.write(f'''
+	palette: Nat -> Pixel;''')
+    file.write(f'''
 	start_x, start_y: Nat;
-	size_x,	size_y: Nat;
+	size_x,	size_y: Nat;''')
+    if stack:
+        file.write(f'''
+	size_i: Nat;''')
+    file.write(f'''
+    ''')
+    if ENCODING == 'tree': # descend left or right depending on the index, halving the subtree size
+        file.write(f'''
+var
+    l, r: Tree;
+    v: {value_sort};
+    i, h: Nat;
+eqn
+    at(leaf(v), i, h) = v;
+    at(node(l, r), i, h) = if(i < h, at(l, i, h div 2), at(r, Int2Nat(i - h), h div 2));
+    ''')
     
-eqn '''
-    result += build_image_grid(imagefile)
-    result += f'''
+    half = 0
+    file.write(f'''
+eqn ''')
+    if stack:
+        if ENCODING == 'rows':
+            for index, rows in enumerate(images):
+                write_image_rows(rows, file, index)
+        elif ENCODING == 'map':
+            for index, rows in enumerate(images):
+                write_image_map(rows, file, index)
+        elif ENCODING == 'tree': # one tree over the pixels of all images
+            half = write_image_tree([literal for rows in images for row in rows for literal in row], file)
+        else:
+            write_image_stack(images, file)
+    elif ENCODING == 'rows':
+        write_image_rows(rows, file)
+    elif ENCODING == 'map':
+        write_image_map(rows, file)
+    elif ENCODING == 'tree':
+        half = write_image_tree([literal for row in rows for literal in row], file)
+    else:
+        write_image_grid(rows, file)
+    if propositions: # holds(i, c) states whether proposition i holds for pixels of class c
+        for index, valuation in enumerate(classes.tolist()):
+            for proposition, value in enumerate(valuation):
+                file.write(f'''
+    holds({proposition}, {index}) = {'true' if value else 'false'};''')
+    elif PALETTE: # every distinct pixel value is written only once
+        for index, colour in enumerate(palette.tolist()):
+            file.write(f'''
+    palette({index}) = {pixel_literal(colour)};''')
+    file.write(f'''
     start_x = 0;
-    start_y = 0;
+    start_y = 0;''')
+    if ENCODING == 'list' and stack:
+        file.write(f'''
+    size_x = Int2Nat(#(image.0.0) - 1);
+    size_y = Int2Nat(#(image.0) - 1);
+    size_i = Int2Nat(#(image) - 1);''')
+    elif ENCODING == 'list':
+        file.write(f'''
     size_x = Int2Nat(#(image.0) - 1);
-    size_y = Int2Nat(#(image) - 1);
+    size_y = Int2Nat(#(image) - 1);''')
+    else: # dimensions are known constants
+        file.write(f'''
+    size_x = {width - 1};
+    size_y = {height - 1};''')
+        if stack:
+            file.write(f'''
+    size_i = {shape[0] - 1};''')
+    if stack:
+        write_stack_process(file, propositions, pixel_lookup(width, half, PALETTE and not propositions, height))
+        return
+    if roi is not None:
+        write_roi_process(file, propositions, pixel_lookup(width, half, PALETTE and not propositions), roi)
+        return
+    if propositions:
+        actions = ', '.join(['R'] + [f'ap_{proposition}' for proposition in range(len(propositions))])
+        lookup = pixel_lookup(width, half, False)
+        reports = ''.join(f'''
+    + holds({proposition}, {lookup}) -> ap_{proposition} . Grid(x,y) ''' for proposition in range(len(propositions)))
+        file.write(f'''
+act
+    {actions};
+proc
+Grid(x:Nat, y: Nat) = 
+    R . Grid(x,y) {reports}''')
+    else:
+        actions = 'R, report'
+        file.write(f'''
 act
     R;
     report: Pixel;
 proc
 Grid(x:Nat, y: Nat) = 
-    report(image.y.x) . Grid(x,y) 
-    + R . Grid(x,y) 
+    report({pixel_lookup(width, half, PALETTE)}) . Grid(x,y) 
+    + R . Grid(x,y) ''')
+    file.write(f'''
     + (x != 0) 		-> R . Grid(Int2Nat(x-1), y)
     + (x != size_x)	-> R . Grid(Int2Nat(x+1), y)
     + (y != 0) 		-> R . Grid(x, Int2Nat(y-1))
     + (y != size_y) -> R . Grid(x, Int2Nat(y+1))
 ;
 init
-    allow ({{R, report}},
+    allow ({{{actions}}},
     comm(
         {{}}, Grid(start_x, start_y)
     )
-);''' # double braces to escape { } characters in f-string
+);''') # double braces to escape { } characters in f-string
+
+# writes the process of a stack of images, every summand of a pixel is guarded by i <= size_i
+# the initial state i = size_i + 1 only has start transitions to the first pixel of every image
+def write_stack_process(file, propositions, lookup):
+    if propositions:
+        actions = ', '.join(['R', 'start'] + [f'ap_{proposition}' for proposition in range(len(propositions))])
+        declarations = f'''
+    {actions};'''
+        reports = ''.join(f'''
+        + holds({proposition}, {lookup}) -> ap_{proposition} . Grid(i,x,y)''' for proposition in range(len(propositions)))
+    else:
+        actions = 'R, start, report'
+        declarations = f'''
+    R, start;
+    report: Pixel;'''
+        reports = f'''
+        + report({lookup}) . Grid(i,x,y)'''
+    file.write(f'''
+act{declarations}
+proc
+Grid(i: Nat, x:Nat, y: Nat) = 
+    (i <= size_i) -> (
+        R . Grid(i,x,y) {reports}
+        + (x != 0) 		-> R . Grid(i, Int2Nat(x-1), y)
+        + (x != size_x)	-> R . Grid(i, Int2Nat(x+1), y)
+        + (y != 0) 		-> R . Grid(i, x, Int2Nat(y-1))
+        + (y != size_y) -> R . Grid(i, x, Int2Nat(y+1))
+    )
+    + (i > size_i) -> (sum j: Nat . (j <= size_i) -> start . Grid(j, start_x, start_y))
+;
+init
+    allow ({{{actions}}},
+    comm(
+        {{}}, Grid(size_i + 1, start_x, start_y)
+    )
+);''') # double braces to escape { } characters in f-string
+
+# writes the process of an image of which only the pixels of the region of interest are verified
+# every summand of a pixel is guarded by x <= size_x, the initial state x = size_x + 1 has a start transition
+# to every pixel of the region, written as one sum per run of pixels within a row
+def write_roi_process(file, propositions, lookup, roi):
+    if propositions:
+        actions = ', '.join(['R', 'start'] + [f'ap_{proposition}' for proposition in range(len(propositions))])
+        declarations = f'''
+    {actions};'''
+        reports = ''.join(f'''
+        + holds({proposition}, {lookup}) -> ap_{proposition} . Grid(x,y)''' for proposition in range(len(propositions)))
+    else:
+        actions = 'R, start, report'
+        declarations = f'''
+    R, start;
+    report: Pixel;'''
+        reports = f'''
+        + report({lookup}) . Grid(x,y)'''
+    starts = [f'start . Grid({x}, {y})' if length == 1 else f'(sum j: Nat . ({x} <= j && j <= {x + length - 1}) -> start . Grid(j, {y}))'
+              for y, x, length in image_output.run_lengths(roi).tolist()]
+    if not starts:
+        raise ValueError('the region of interest contains no pixels')
+    starts = '''
+        + '''.join(starts)
+    file.write(f'''
+act{declarations}
+proc
+Grid(x:Nat, y: Nat) = 
+    (x <= size_x) -> (
+        R . Grid(x,y) {reports}
+        + (x != 0) 		-> R . Grid(Int2Nat(x-1), y)
+        + (x != size_x)	-> R . Grid(Int2Nat(x+1), y)
+        + (y != 0) 		-> R . Grid(x, Int2Nat(y-1))
+        + (y != size_y) -> R . Grid(x, Int2Nat(y+1))
+    )
+    + (x > size_x) -> (
+        {starts}
+    )
+;
+init
+    allow ({{{actions}}},
+    comm(
+        {{}}, Grid(size_x + 1, start_y)
+    )
+);''') # double braces to escape { } characters in f-string
+
+# builds the .mcrl2 file
+def build_mCRL2_spec(imagefile, propositions = None, roi = None):
+    output = io.StringIO()
+    write_mCRL2_spec(imagefile, output, propositions, roi)
+    result = output.getvalue()
+    output.close()
     return result
 
 def write_to_mcrl2(mcrl2spec, basefile):
@@ -95,13 +413,24 @@ def write_to_mcrl2(mcrl2spec, basefile):
         file.write(mcrl2spec)
     return mcrl2specfile
 
-def create_mcrl2_specification(imagefile, greyscale):
+# basefile optionally overrides the path of the specification without extension, which defaults to the path of the image
+def create_mcrl2_specification(imagefile, greyscale, palette = False, encoding = 'list', propositions = None, roi = None, basefile = None):
     if greyscale:
         global GREYSCALE
         GREYSCALE = True
-    mcrl2spec = build_mCRL2_spec(imagefile) # create string containing spec
-    basefile = imagefile.rsplit('.', 1)[0] # remove extension by splitting only first dot from right side
-    mcrl2specfile = write_to_mcrl2(mcrl2spec, basefile) # write to file
+    if palette:
+        global PALETTE
+        PALETTE = True
+    global ENCODING
+    ENCODING = encoding
+    if basefile is None:
+        if isinstance(imagefile, str):
+            basefile = imagefile.rsplit('.', 1)[0] # remove extension by splitting only first dot from right side
+        else: # stack of images, named after the first one
+            basefile = imagefile[0].rsplit('.', 1)[0] + f'_stack{len(imagefile)}'
+    mcrl2specfile = basefile + '.mcrl2'
+    with stage_profiler.stage('spec generation', mcrl2specfile), open(mcrl2specfile, "w") as file: # stream the spec to file
+        write_mCRL2_spec(imagefile, file, propositions, roi)
 
     print(f'[image2mcrl2]    successfully saved mcrl2 specification of {imagefile} to {mcrl2specfile}')
     
@@ -117,8 +446,10 @@ def check_image_extension(imagefile):
 if __name__ == '__main__':
     # handle argument parsing and save args to list
     parser = argparse.ArgumentParser()
-    parser.add_argument("image", help = "the image to be converted to a mcrl2 specification, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("image", help = "the image to be converted to a mcrl2 specification, allowed formats: png, jpg, jpeg; multiple images of equal dimensions are emitted as one stack", type=check_image_extension, nargs = '+')
     parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the image", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the image: " + "; ".join(f'{name}: {info}' for name, info in ENCODINGS.items()), choices = ENCODINGS, default = 'list')
     args = parser.parse_args()
 
-    mcrl2specfile = create_mcrl2_specification(args.image, args.greyscale)
+    mcrl2specfile = create_mcrl2_specification(args.image[0] if len(args.image) == 1 else args.image, args.greyscale, args.palette, args.encoding)
@@ -0,0 +1,91 @@
+'''
+image_output
+Marks and exports the pixels that satisfy a formula, given as boolean mask of shape (height, width)
+
+The marked image is produced by a single array assignment instead of a putpixel call per
+pixel. Besides the marked image, the mask can be exported in compact formats:
+    npy     the boolean mask
+    npz     the mask packed to one bit per pixel, restored by load_mask
+    rle     one run of satisfying pixels per line: y, x, length
+    boxes   the bounding box of every connected component (4-neighbourhood): x0, y0, x1, y1 (inclusive), pixels
+    alpha   a PNG of mode L that is opaque (255) on satisfying pixels, usable as alpha channel
+'''
+import csv
+import numpy as np
+from PIL import Image
+
+import native_image
+
+PRINT_COORDS = True # print the list of satisfying coordinates, otherwise only their amount
+EXPORT_FORMATS = ['npy', 'npz', 'rle', 'boxes', 'alpha']
+
+# Text describing the satisfying coordinates for the output of the scripts
+def describe_coords(true_coords):
+    if PRINT_COORDS:
+        return f'{true_coords}'
+    return f'{len(true_coords)} pixels'
+
+# Copy of the image in which the pixels of the mask have the mark colour
+def mark_image(im, mask, mark_colour):
+    if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGB')
+    pixels = np.array(im)
+    pixels[mask] = tuple(mark_colour) + (255,) * (pixels.shape[-1] - 3) # like putpixel, marked pixels become opaque
+    return Image.fromarray(pixels, im.mode)
+
+# Runs of satisfying pixels within the rows of the mask, as array of (y, x, length) rows
+def run_lengths(mask):
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1) # 1 where a run starts, -1 after it ends
+    ys, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1] # in the same row-major order as the starts
+    return np.column_stack((ys, starts, ends - starts))
+
+# Bounding boxes of the connected components of the mask, as array of (x0, y0, x1, y1, pixels) rows
+def bounding_boxes(mask):
+    labels = native_image.label_components(mask).ravel()
+    pixels = np.flatnonzero(mask)
+    if len(pixels) == 0:
+        return np.zeros((0, 5), dtype=np.int64)
+    order = np.argsort(labels[pixels], kind='stable')
+    pixels = pixels[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(labels[pixels]) != 0]) # first pixel of every component
+    ys, xs = np.divmod(pixels, mask.shape[1])
+    return np.column_stack((np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                            np.maximum.reduceat(xs, starts), np.maximum.reduceat(ys, starts),
+                            np.diff(np.r_[starts, len(pixels)])))
+
+# Saves the mask in the given format as [basefile]_mask.npy, _mask.npz, _rle.csv, _boxes.csv or _mask.png
+def save_mask(mask, basefile, format):
+    if format == 'npy':
+        outputfile = basefile + '_mask.npy'
+        np.save(outputfile, mask)
+    elif format == 'npz':
+        outputfile = basefile + '_mask.npz'
+        np.savez_compressed(outputfile, bits=np.packbits(mask), shape=mask.shape)
+    elif format in ('rle', 'boxes'):
+        outputfile = f'{basefile}_{format}.csv'
+        with open(outputfile, 'w', newline='') as file:
+            writer = csv.writer(file)
+            if format == 'rle':
+                writer.writerow(['y', 'x', 'length'])
+                writer.writerows(run_lengths(mask).tolist())
+            else:
+                writer.writerow(['x0', 'y0', 'x1', 'y1', 'pixels'])
+                writer.writerows(bounding_boxes(mask).tolist())
+    elif format == 'alpha':
+        outputfile = basefile + '_mask.png'
+        Image.fromarray(mask.astype(np.uint8) * 255, 'L').save(outputfile, 'PNG')
+    else:
+        raise ValueError(f'unknown export format {format}')
+    return outputfile
+
+# Loads a mask saved as .npy or packed .npz by save_mask
+def load_mask(maskfile):
+    if maskfile.endswith('.npz'):
+        with np.load(maskfile) as data:
+            shape = tuple(data['shape'])
+            return np.unpackbits(data['bits'], count=int(np.prod(shape))).reshape(shape).astype(bool)
+    return np.load(maskfile)
@@ -0,0 +1,241 @@
+'''
+native_image
+Evaluates a SLCS formula directly on an image, without the mCRL2 toolset
+
+Every subformula of the AST built by slcs2modalmu is computed as a boolean
+mask over the pixel grid: atomic propositions are vectorized range checks,
+N is a dilation over the 4-neighbourhood (including the pixel itself, like
+the R self-loop of the mCRL2 model) and S is a reachability fixpoint computed
+via connected components. The resulting coordinates are the same as the ones
+returned by pbessolve_image.do_pbessolve, so both engines can be cross-checked.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import itertools
+import numpy as np
+from PIL import Image
+
+import image_output
+import slcs2modalmu
+
+# Loads the pixel values of an image as an array of shape (height, width, channels)
+# only the first channel is kept for monochromatic images, mirroring image2mcrl2
+def load_pixels(imagefile, greyscale):
+    with Image.open(imagefile) as im:
+        return image_pixels(im, greyscale)
+
+# Pixel values of an opened image (or frame of a multi-page image), see load_pixels
+def image_pixels(im, greyscale):
+    data = np.asarray(im, dtype=np.int32)
+    if data.ndim == 2: # single band images, e.g. mode L
+        data = data[..., np.newaxis]
+    if greyscale:
+        return data[..., :1]
+    if data.shape[-1] == 1: # repeat single band for RGB predicates
+        return np.repeat(data, 3, axis=-1)
+    return data[..., :3]
+
+# Computes the mask of pixels whose values lie within the ranges of an atomic proposition
+def atom_mask(pixels, value):
+    ranges = slcs2modalmu.atomic_ranges(value)
+    if len(ranges) != pixels.shape[-1]:
+        raise SyntaxError(f'Atomic proposition \'{value}\' does not match the amount of channels of the image')
+    mask = np.ones(pixels.shape[:-1], dtype=bool)
+    for channel, (low, high) in enumerate(ranges):
+        mask &= (pixels[..., channel] >= low) & (pixels[..., channel] <= high)
+    return mask
+
+# Pixels that have a neighbour (or are themselves) in the mask
+def near(mask):
+    result = mask.copy()
+    for axis in range(mask.ndim):
+        lower = [slice(None)] * mask.ndim
+        upper = [slice(None)] * mask.ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        result[tuple(lower)] |= mask[tuple(upper)]
+        result[tuple(upper)] |= mask[tuple(lower)]
+    return result
+
+# Minimum over the elements j on the same line along the axis of values[j] + |i - j|, for every element i
+# i.e. a 1D distance transform with the L1 metric, computed by a forward and a backward running minimum
+def line_transform(values, axis):
+    index = np.arange(values.shape[axis]).reshape([-1 if dimension == axis else 1 for dimension in range(values.ndim)])
+    forward = np.minimum.accumulate(values - index, axis=axis) + index
+    backward = np.flip(np.minimum.accumulate(np.flip(values + index, axis), axis=axis), axis) - index
+    return np.minimum(forward, backward)
+
+# Pixels within k steps (4-neighbourhood) of the mask, i.e. N applied k times
+# the L1 distance transform is separable, so this takes one transform per axis regardless of k
+def near_within(mask, k):
+    if not mask.any():
+        return mask.copy()
+    distance = np.where(mask, 0, sum(mask.shape)) # larger than any distance within the grid
+    for axis in range(mask.ndim):
+        distance = line_transform(distance, axis)
+    return distance <= k
+
+# Pixels within Euclidean distance k of the mask
+# the squared distance along the first axis is combined with offsets up to k along the other axes
+def distance_within(mask, k):
+    if not mask.any():
+        return mask.copy()
+    distance = line_transform(np.where(mask, 0, max(mask.shape[0], k + 1)), 0)
+    squared = np.minimum(distance, k + 1) ** 2 # distances beyond k, or lines without pixels of the mask, are equal as far as the result is concerned
+    for axis in range(1, mask.ndim):
+        result = squared.copy()
+        for offset in range(1, k + 1):
+            lower = [slice(None)] * mask.ndim
+            upper = [slice(None)] * mask.ndim
+            lower[axis] = slice(None, -offset)
+            upper[axis] = slice(offset, None)
+            lower, upper = tuple(lower), tuple(upper)
+            np.minimum(result[lower], squared[upper] + offset ** 2, out=result[lower])
+            np.minimum(result[upper], squared[lower] + offset ** 2, out=result[upper])
+        squared = result
+    return squared <= k ** 2
+
+# Merges the trees of sources and targets with a vectorized union-find over size elements
+# returns for every element the smallest element of its set
+def union_find(size, sources, targets):
+    parent = np.arange(size)
+    while True:
+        # pointer jumping until every element refers to the root of its tree
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        source_roots, target_roots = parent[sources], parent[targets]
+        unmerged = source_roots != target_roots
+        if not unmerged.any():
+            return parent
+        # only edges between different trees remain relevant, hook the larger root onto the smaller
+        sources, targets = sources[unmerged], targets[unmerged]
+        source_roots, target_roots = source_roots[unmerged], target_roots[unmerged]
+        np.minimum.at(parent, np.maximum(source_roots, target_roots), np.minimum(source_roots, target_roots))
+
+# Labels the connected components (4-neighbourhood) of a mask
+# every pixel in the mask gets the smallest flat index of its component, others get mask.size
+def label_components(mask):
+    size = mask.size
+    index = np.arange(size).reshape(mask.shape)
+    sources, targets = [], []
+    for axis in range(mask.ndim): # edges between neighbouring pixels that are both in the mask
+        lower = [slice(None)] * mask.ndim
+        upper = [slice(None)] * mask.ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        lower, upper = tuple(lower), tuple(upper)
+        both = mask[lower] & mask[upper]
+        sources.append(index[lower][both])
+        targets.append(index[upper][both])
+    parent = union_find(size, np.concatenate(sources), np.concatenate(targets))
+    return np.where(mask.ravel(), parent, size).reshape(mask.shape)
+
+# Pixels satisfying phi_1 that cannot reach a pixel satisfying neither phi_1 nor phi_2
+# via a path of phi_1 pixels, i.e. phi_1 && !mu X.(!(phi_1 || phi_2) || (phi_1 && <R>X))
+def surround(phi_1, phi_2):
+    escape = near(~(phi_1 | phi_2)) & phi_1 # phi_1 pixels adjacent to an escape route
+    labels = label_components(phi_1)
+    escaped = np.isin(labels, np.unique(labels[escape]))
+    return phi_1 & ~escaped
+
+# Computes the satisfaction mask of the (sub)formula with the given node as root
+# memo maps nodes to their masks, so nodes shared by an optimized DAG are evaluated once
+# propositions optionally maps keys of precomputed (sub)formulae to their masks, see slcs2modalmu.proposition_key
+def evaluate_tree(tree, pixels, memo = None, propositions = None):
+    if memo is None:
+        memo = {}
+    if id(tree) in memo:
+        return memo[id(tree)]
+    if propositions and slcs2modalmu.proposition_key(tree) in propositions:
+        mask = propositions[slcs2modalmu.proposition_key(tree)]
+    elif tree.is_leaf(): # atomic proposition
+        mask = atom_mask(pixels, tree.value)
+    else:
+        # set subformula masks
+        phi_1 = evaluate_tree(tree.left, pixels, memo, propositions) if tree.left is not None else None
+        phi_2 = evaluate_tree(tree.right, pixels, memo, propositions) if tree.right is not None else None
+        if tree.value == '!':
+            mask = ~phi_2
+        elif tree.value == '&&':
+            mask = phi_1 & phi_2
+        elif tree.value == '||':
+            mask = phi_1 | phi_2
+        elif tree.value == 'N':
+            mask = near(phi_2)
+        elif slcs2modalmu.near_bound(tree.value) is not None: # N^k
+            mask = near_within(phi_2, slcs2modalmu.near_bound(tree.value))
+        elif slcs2modalmu.distance_bound(tree.value) is not None: # D[<=k]
+            mask = distance_within(phi_2, slcs2modalmu.distance_bound(tree.value))
+        elif tree.value == 'S':
+            mask = surround(phi_1, phi_2)
+        elif tree.value == None: # None-values only occur under excessive bracket usage
+            mask = phi_1
+        else:
+            raise SyntaxError(f'Operator \'{tree.value}\' is not supported by the native engine')
+    memo[id(tree)] = mask
+    return mask
+
+# Computes the masks of the given (sub)formulae, used as precomputed propositions by image2mcrl2
+def proposition_masks(imagefile, propositions, greyscale):
+    pixels = load_pixels(imagefile, greyscale)
+    return [evaluate_tree(tree, pixels) for tree in propositions]
+
+# Collects the atomic propositions of the SLCS formula and computes their masks on the image
+def precompute_atomic_predicates(imagefile, SLCSformula, greyscale):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+    predicates = slcs2modalmu.collect_atomic_predicates(SLCS_Ast)
+    return predicates, proposition_masks(imagefile, predicates, greyscale)
+
+# Converts a mask to a list of (x, y) coordinates, in the same format as pbessolve_image
+def mask_to_coords(mask):
+    ys, xs = np.nonzero(mask)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+# Converts a list of (x, y) coordinates to a mask with the given (height, width) shape
+def coords_to_mask(coords, shape):
+    mask = np.zeros(shape, dtype=bool)
+    if coords:
+        coords = np.fromiter(itertools.chain.from_iterable(coords), dtype=np.int64, count=2 * len(coords)).reshape(-1, 2)
+        mask[coords[:, 1], coords[:, 0]] = True
+    return mask
+
+# roi optionally restricts the result to the pixels of a boolean mask, see roi_image
+def do_native(imagefile, SLCSformula, greyscale, optimize = False, roi = None):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True) # atomic propositions in mcrl2 format
+    if optimize:
+        SLCS_Ast = slcs2modalmu.optimize_tree(SLCS_Ast)
+    pixels = load_pixels(imagefile, greyscale)
+    mask = evaluate_tree(SLCS_Ast, pixels)
+    if roi is not None:
+        mask &= roi
+    true_coords = mask_to_coords(mask)
+
+    print(f'[native_image]    pixel coordinates that satisfy {SLCSformula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--optimize", help = "evaluate common subformulae only once", action = "store_true")
+    args = parser.parse_args()
+
+    true_coords = do_native(args.image, args.slcsformula, args.greyscale, args.optimize)
@@ -11,15 +11,31 @@ For input arguments, see also the help file invoked by setting the -h flag.
 '''
 import argparse
 import os
-import subprocess
 import re
+import shutil
+import subprocess
+import tempfile
+
+import image_output
+import stage_profiler
 
-MCRL2PATH = 'C:/Program Files/mCRL2/bin/' # path to MCRL2 executables folder
+MCRL2PATH = os.environ.get('MCRL2PATH', 'C:/Program Files/mCRL2/bin/') # path to MCRL2 executables folder, otherwise the tools are looked up on the PATH
+SCRATCH_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None # tmpfs for the files of the tools, None for the default temporary directory
 save_debug_output_to_file = False # save debug output to file for debugging
 only_run_pbessolve = False # Only run pbessolve for debugging
+CHUNK_SIZE = 1 << 20 # amount of bytes read from the pbessolve output stream at once
+
+# precompiled regexes for the debug output of pbessolve, matched on raw bytes
+VERTEX_REGEX = re.compile(rb'(\d+) vertex\(formula = (\w+)\((\d+(?:, \d+)*)\)') # (x, y), or (i, x, y) for a stack of images
+DECORATION_REGEX = re.compile(rb'decoration = (\w+)')
+STRATEGY_REGEX = re.compile(rb'tau\[(\d+)\] = (\d+)')
+W0_REGEX = re.compile(rb'W0 = \{\s*(.*?)\s*\}')
+W1_REGEX = re.compile(rb'W1 = \{\s*(.*?)\s*\}')
 
 # BES_Equation object
 class BES_Equation:
+    __slots__ = ('identifier', 'is_target', 'coords', 'decoration')
+
     def __init__(self, identifier, is_target, coords, decoration) -> None:
         self.identifier = identifier
         self.is_target = is_target
@@ -39,30 +55,63 @@ class BES_Equation:
         self.decoration = decoration
         return
 
+# Path of an mCRL2 tool: in MCRL2PATH (with or without .exe) if it is there, otherwise on the PATH
+def mcrl2_tool(name):
+    for executable in (name, name + '.exe'):
+        path = os.path.join(MCRL2PATH, executable)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    path = shutil.which(name)
+    if path is None:
+        raise FileNotFoundError(f'mCRL2 tool {name} not found in {MCRL2PATH} or on the PATH, set the MCRL2PATH environment variable')
+    return path
+
 # Execute mcrl22lps and lps2pbes on the given specification and formula
 # Requires formula to be in the /properties folder of the project
-def execute_prelim_mCRL2(specification, formula):
+# the .lps and .pbes are written to workdir if given, otherwise next to the specification
+def execute_prelim_mCRL2(specification, formula, workdir = None):
     basefile = specification.rsplit('.', 1)[0] # remove extension by splitting only first dot from right side
+    if workdir is not None:
+        basefile = os.path.join(workdir, os.path.basename(basefile))
 
-    # execute mcrl22lps
     lpsfile = basefile + '.lps'
-    print(f'\n[pbessolve_image]    executing mcrl22lps on {specification} ... \n')
-    subprocess.run([f'{MCRL2PATH}/mcrl22lps.exe', specification, lpsfile, '--verbose'])
+    run_mcrl22lps(specification, lpsfile)
 
-    # execute lps2pbes
     pbesfile = basefile + '.pbes'
     # dir = os.path.dirname(os.path.realpath(specification))
-    print(f'\n[pbessolve_image]    executing lps2pbes on {lpsfile}, {formula} ... \n')
-    subprocess.run([f'{MCRL2PATH}/lps2pbes.exe', lpsfile, pbesfile, f'--formula={formula}', '--verbose'])
+    run_lps2pbes(lpsfile, formula, pbesfile)
     
     return(lpsfile, pbesfile)
 
+# execute mcrl22lps
+def run_mcrl22lps(specification, lpsfile):
+    print(f'\n[pbessolve_image]    executing mcrl22lps on {specification} ... \n')
+    with stage_profiler.stage('mcrl22lps', lpsfile):
+        returncode = stage_profiler.run([mcrl2_tool('mcrl22lps'), specification, lpsfile, '--verbose'])
+    if returncode != 0: # the .lps may be missing or left by an earlier run
+        raise RuntimeError(f'mcrl22lps exited with code {returncode}')
+    return lpsfile
+
+# execute lps2pbes
+def run_lps2pbes(lpsfile, formula, pbesfile):
+    print(f'\n[pbessolve_image]    executing lps2pbes on {lpsfile}, {formula} ... \n')
+    with stage_profiler.stage('lps2pbes', pbesfile):
+        returncode = stage_profiler.run([mcrl2_tool('lps2pbes'), lpsfile, pbesfile, f'--formula={formula}', '--verbose'])
+    if returncode != 0: # the .pbes may be missing or left by an earlier formula
+        raise RuntimeError(f'lps2pbes exited with code {returncode}')
+    return pbesfile
+
+# Version string of the mCRL2 toolset, the first line of mcrl22lps --version
+def toolset_version():
+    version = subprocess.run([mcrl2_tool('mcrl22lps'), '--version'], capture_output=True, text=True)
+    return version.stdout.strip().split('\n')[0]
+
 # Create a list of equations whose decorations state whether they satisfy the formula
 def parse_pbessolve_output(lpsfile, pbesfile):
     lps_dir = os.path.realpath(lpsfile)
 
     if(only_run_pbessolve):
-        subprocess.call([f'{MCRL2PATH}/pbessolve.exe', pbesfile, f'--file={lps_dir}', '--verbose'])
+        subprocess.call([mcrl2_tool('pbessolve'), pbesfile, f'--file={lps_dir}', '--verbose'])
         return [] # return empty equation list since we dont parse
 
     # save pbessolve to file
@@ -70,7 +119,7 @@ def parse_pbessolve_output(lpsfile, pbesfile):
         outputfile = f"{pbesfile}.output.txt"
         with open(outputfile, "w") as f:
             pbessolve_output = subprocess.Popen(
-                 [f'{MCRL2PATH}/pbessolve.exe', pbesfile, f'--file={lps_dir}', '--verbose', '--debug'],
+                 [mcrl2_tool('pbessolve'), pbesfile, f'--file={lps_dir}', '--verbose', '--debug'],
                  stderr=subprocess.STDOUT, # stderr contains all the debug output, redirect to stdout
                  stdout=f,
             )
@@ -79,85 +128,181 @@ def parse_pbessolve_output(lpsfile, pbesfile):
 
     # execute pbessolve and create output stream
     print(f'\n[pbessolve_image]    executing pbessolve on {pbesfile} and {lpsfile} ... ')
-    pbessolve_output = subprocess.Popen(
-        [f'{MCRL2PATH}/pbessolve.exe', pbesfile, f'--file={lps_dir}', '--verbose', '--debug'],
-        stderr=subprocess.STDOUT, # stderr contains all the debug output, redirect to stdout
-        stdout=subprocess.PIPE, # create pipe for output stream
-    )
-
-    # parse output
-    print(f'\n[pbessolve_image]    parsing pbessolve output ... ')
-    allowParse = False
-    BES_Equation_List = []
-    
-    while True:
-        line = pbessolve_output.stdout.readline().rstrip().decode('utf-8') # read output line as string
+    with stage_profiler.stage('pbessolve'): # output is parsed while pbessolve runs, cpu_time is the parsing
+        pbessolve_output = subprocess.Popen(
+            [mcrl2_tool('pbessolve'), pbesfile, f'--file={lps_dir}', '--verbose', '--debug'],
+            stderr=subprocess.STDOUT, # stderr contains all the debug output, redirect to stdout
+            stdout=subprocess.PIPE, # create pipe for output stream
+        )
+
+        # parse output
+        print(f'\n[pbessolve_image]    parsing pbessolve output ... ')
+        BES_Equation_List = parse_pbessolve_stream(pbessolve_output.stdout)
+        pbessolve_output.stdout.read() # drain remaining output so pbessolve can finish writing the evidence
+        returncode = stage_profiler.wait(pbessolve_output)
+    if returncode != 0: # the parsed equations are incomplete
+        raise RuntimeError(f'pbessolve exited with code {returncode}')
+
+    return BES_Equation_List
+
+# Incremental parser for the debug output of pbessolve
+# Equations are stored by their integer id, so strategy and W0/W1 updates are constant time per id
+class Pbessolve_Output_Parser:
+    def __init__(self) -> None:
+        self.equations = {} # maps integer id to BES_Equation, in order of appearance
+        self.allow_parse = False
+        self.finished = False
+        self.remainder = b'' # incomplete last line of the previous chunk
+        self.strategy_lines = 0 # amount of parsed lines of each kind, for profiling
+        self.W0_updates = 0
+        self.W1_updates = 0
+
+    # parse a chunk of raw output, lines may be split over multiple chunks
+    def feed(self, chunk):
+        lines = (self.remainder + chunk).split(b'\n')
+        self.remainder = lines.pop()
+        for line in lines:
+            if self.finished:
+                return
+            self.parse_line(line)
 
+    # parse the last line in case the output did not end with a newline
+    def close(self):
+        if not self.finished and self.remainder:
+            self.parse_line(self.remainder)
+        self.remainder = b''
+
+    def parse_line(self, line):
         # start/stop parsing equations to avoid creating duplicate equations
-        if '--- solve_recursive_extended input ---' in line:
-            allowParse = True
-        elif '--- solve_recursive input ---' in line:
-            allowParse = False
+        if b'--- solve_recursive_extended input ---' in line:
+            self.allow_parse = True
+        elif b'--- solve_recursive input ---' in line:
+            self.allow_parse = False
         # end after extracting all information
-        elif 'Extracting evidence...' in line:
-            break
+        elif b'Extracting evidence...' in line:
+            self.finished = True
         # parse equation
-        elif allowParse and 'vertex(formula' in line:
-
-            id = re.search('(\d+) vertex', line).group(1)
+        elif self.allow_parse and b'vertex(formula' in line:
+            vertex = VERTEX_REGEX.search(line)
+            id = int(vertex.group(1))
             # Mark equation as target depending on prefix
             # TODO standardize this (second equation always has the desired prefix?)
-            is_target = True if re.search('formula = (X0)', line) is not None else False 
-
-            x, y = re.search('formula = \w+\((\d+), (\d+)\)', line).groups() 
-            coords = (int(x), int(y))
-
-            decoration = re.search('decoration = (\w+)', line).group(1)
-            # save predecessors to int list
-            # predecessors_regex = re.search('predecessors = \[\s*(.*?)\s*\]', line)
-            # if predecessors_regex.group(1):
-            #     predecessors = [int(x) for x in predecessors_regex.group(1).split(", ")]
-            # else:
-            #     predecessors = []
-            # # save successors to int list
-            # successors_regex = re.search('successors = \[\s*(.*?)\s*\]', line)
-            # if successors_regex.group(1):
-            #     successors = [int(x) for x in successors_regex.group(1).split(", ")]
-            # else:
-            #     successors = []
-            
-            equation = BES_Equation(id, is_target, coords, decoration)
-
-            BES_Equation_List.append(equation)
+            is_target = vertex.group(2).startswith(b'X0')
+            coords = tuple(int(value) for value in vertex.group(3).split(b', '))
+            decoration = DECORATION_REGEX.search(line).group(1).decode('utf-8')
+            self.equations[id] = BES_Equation(id, is_target, coords, decoration)
 
         # parse strategy lines
-        elif 'set tau' in line:
-            id_src, id_trg = re.search('tau\[(\d+)\] = (\d+)', line).groups() # extract source/target id of the strategy
-            # find corresponding equations
-            src_eq = next(equation for equation in BES_Equation_List if equation.get_id() == id_src)
-            trg_eq = next(equation for equation in BES_Equation_List if equation.get_id() == id_trg)
+        elif b'set tau' in line:
+            self.strategy_lines += 1
+            id_src, id_trg = STRATEGY_REGEX.search(line).groups() # extract source/target id of the strategy
             # if target decoration is true/false, update source decoration accordingly, else skip
-            trg_deco = trg_eq.get_decoration()
+            trg_deco = self.equations[int(id_trg)].get_decoration()
             if trg_deco == 'true' or trg_deco == 'false':
-                src_eq.set_decoration(trg_deco)
-        
+                self.equations[int(id_src)].set_decoration(trg_deco)
+
         # Check all solutions to solve_recursive (TODO: currently does all iterations, only check final one?)
-        elif 'W0 = {' in line:
-            W0_regex = re.search('W0 = \{\s*(.*?)\s*\}', line)
-            W0_ids = [int(x) for x in W0_regex.group(1).split(", ") if x != '']
-            # Set all decorations of equations that occur in W0 to true
-            for equation in BES_Equation_List:
-                if int(equation.get_id()) in W0_ids: # force int for quick comparison
-                    equation.set_decoration('true')
-        elif 'W1 = {' in line:
-            W1_regex = re.search('W1 = \{\s*(.*?)\s*\}', line)
-            W1_ids = [int(x) for x in W1_regex.group(1).split(", ") if x != '']
-            # Set all decorations of equations that occur in W1 to false
-            for equation in BES_Equation_List:
-                if int(equation.get_id()) in W1_ids: # force int for quick comparison
-                    equation.set_decoration('false')
+        elif b'W0 = {' in line:
+            self.W0_updates += 1
+            self.set_decorations(W0_REGEX.search(line).group(1), 'true')
+        elif b'W1 = {' in line:
+            self.W1_updates += 1
+            self.set_decorations(W1_REGEX.search(line).group(1), 'false')
 
-    return BES_Equation_List
+    # set the decoration of all known equations in a comma separated id set
+    def set_decorations(self, ids, decoration):
+        equations = self.equations
+        for id in ids.split(b', '):
+            if id:
+                equation = equations.get(int(id))
+                if equation is not None:
+                    equation.set_decoration(decoration)
+
+    def get_equations(self):
+        return list(self.equations.values())
+
+# Parse a binary stream containing pbessolve debug output, reading it in large chunks
+def parse_pbessolve_stream(stream):
+    parser = Pbessolve_Output_Parser()
+    while not parser.finished:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk: # end of stream
+            parser.close()
+            break
+        parser.feed(chunk)
+    stage_profiler.count('bes_equations', len(parser.equations))
+    stage_profiler.count('strategy_lines', parser.strategy_lines)
+    stage_profiler.count('W0_updates', parser.W0_updates)
+    stage_profiler.count('W1_updates', parser.W1_updates)
+    return parser.get_equations()
+
+# Runs the mCRL2 tools of one verification in an isolated scratch directory, which is removed afterwards
+# mcrl22lps runs in the background from linearise() on, e.g. while the formula is translated, and the
+# .pbes is piped from lps2pbes into the tool that solves it instead of being written to disk
+class Toolchain_Run:
+    def __init__(self) -> None:
+        self.directory = None
+        self.lpsfile = None
+        self.linearisation = None # mcrl22lps process, None once it is waited for
+        self.tools = [] # processes started by pipe_pbes
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='spatial_mcrl2_', dir=SCRATCH_DIR)
+        return self
+
+    def __exit__(self, *exception):
+        for process in [self.linearisation, *self.tools]: # e.g. the formula could not be translated or the output not be parsed
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    # starts mcrl22lps on the specification without waiting for it
+    def linearise(self, specification):
+        self.lpsfile = os.path.join(self.directory, os.path.basename(specification).rsplit('.', 1)[0] + '.lps')
+        print(f'\n[pbessolve_image]    executing mcrl22lps on {specification} in the background ... \n')
+        self.linearisation = subprocess.Popen([mcrl2_tool('mcrl22lps'), specification, self.lpsfile, '--verbose'])
+        return self.lpsfile
+
+    # waits for mcrl22lps, the stage only covers the time that is not overlapped by other work
+    def wait_linearisation(self):
+        if self.linearisation is None:
+            return self.lpsfile
+        with stage_profiler.stage('mcrl22lps', self.lpsfile):
+            returncode = stage_profiler.wait(self.linearisation)
+        self.linearisation = None
+        if returncode != 0:
+            raise RuntimeError(f'mcrl22lps exited with code {returncode}')
+        return self.lpsfile
+
+    # starts lps2pbes on the formula, piping the .pbes into the standard input of the given tool
+    # returns both processes, the output of the tool is a pipe as well
+    def pipe_pbes(self, formula, arguments):
+        self.wait_linearisation()
+        lps2pbes = subprocess.Popen([mcrl2_tool('lps2pbes'), self.lpsfile, f'--formula={formula}', '--verbose'], stdout=subprocess.PIPE)
+        self.tools.append(lps2pbes)
+        tool = subprocess.Popen(arguments, stdin=lps2pbes.stdout, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.directory)
+        self.tools.append(tool)
+        lps2pbes.stdout.close() # the tool holds the only reading end, so lps2pbes stops if the tool exits
+        return lps2pbes, tool
+
+    # waits for the processes of pipe_pbes, a failed tool would otherwise leave a partial (e.g. empty) result
+    def wait_pbes(self, lps2pbes, tool, name):
+        for process, process_name in ((lps2pbes, 'lps2pbes'), (tool, name)):
+            returncode = stage_profiler.wait(process)
+            if returncode != 0:
+                raise RuntimeError(f'{process_name} exited with code {returncode}')
+
+    # runs lps2pbes and pbessolve, returns the equations parsed from the debug output of pbessolve
+    def solve(self, formula):
+        self.wait_linearisation()
+        print(f'\n[pbessolve_image]    executing lps2pbes on {self.lpsfile}, {formula} and pbessolve on its output ... ')
+        with stage_profiler.stage('pbessolve'): # includes lps2pbes, whose output is solved while it is written
+            lps2pbes, pbessolve = self.pipe_pbes(formula, [mcrl2_tool('pbessolve'), f'--file={os.path.realpath(self.lpsfile)}', '--verbose', '--debug'])
+            BES_Equation_List = parse_pbessolve_stream(pbessolve.stdout)
+            pbessolve.stdout.read() # drain remaining output so pbessolve can finish writing the evidence
+            self.wait_pbes(lps2pbes, pbessolve, 'pbessolve')
+        return BES_Equation_List
 
 # Print solutions of the final equation list
 # Add coordinates of equations with target prefix to their designated lists
@@ -172,12 +317,30 @@ def extract_solutions(BES_Equation_List):
             #     falseList.append(equation.get_coords())
     return trueList
 
-def do_pbessolve(specification, formula):
-    (lpsfile, pbesfile) = execute_prelim_mCRL2(specification, formula) # execute mcrl22lps and lps2pbes
-    parsed_equations = parse_pbessolve_output(lpsfile, pbesfile) # execute pbessolve and process its debug output
-    true_coords = extract_solutions(parsed_equations) # print solutions
+# Split the coordinates (i, x, y) of a stack of images into the (x, y) coordinates of every image
+# coordinates of the initial state i = size_i + 1 of the stack are not part of any image
+def split_stack_solutions(true_coords, images):
+    image_coords = [[] for _ in range(images)]
+    for (i, x, y) in true_coords:
+        if i < images:
+            image_coords[i].append((x, y))
+    return image_coords
+
+# run optionally is a Toolchain_Run that already linearises the specification
+def do_pbessolve(specification, formula, run = None):
+    if save_debug_output_to_file or only_run_pbessolve: # keep the .lps and .pbes next to the specification for debugging
+        (lpsfile, pbesfile) = execute_prelim_mCRL2(specification, formula) # execute mcrl22lps and lps2pbes
+        parsed_equations = parse_pbessolve_output(lpsfile, pbesfile) # execute pbessolve and process its debug output
+    elif run is not None:
+        parsed_equations = run.solve(formula)
+    else:
+        with Toolchain_Run() as run:
+            run.linearise(specification)
+            parsed_equations = run.solve(formula)
+    with stage_profiler.stage('output parsing'):
+        true_coords = extract_solutions(parsed_equations) # print solutions
 
-    print(f'[pbessolve_image]    pixel coordinates that satisfy {formula}: {true_coords}')
+    print(f'[pbessolve_image]    pixel coordinates that satisfy {formula}: {image_output.describe_coords(true_coords)}')
 
     return true_coords
 
@@ -0,0 +1,192 @@
+'''
+pgsolve_image
+Extracts a global solution to an image model generated by image2mcrl2 and
+formula constructed by slcs2modalmu, by solving the instantiated parity game in Python
+
+The PBES is instantiated by pbesinst into a parity game in PGSolver format,
+which is parsed into compact integer arrays and solved with Zielonka's
+recursive algorithm. This avoids the pbessolve debug log altogether.
+
+NOTE: Like pbessolve_image, the vertices that represent the solution for a pixel
+are recognised by the automatic fixed point naming convention of mCRL2 (X0) and
+the naming scheme pbesinst uses for instantiated variables, e.g. X0(3, 4),
+X0@@3#4 or X0_3_4. If either ever changes, VERTEX_NAME_REGEX should be altered too.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import re
+import numpy as np
+
+import image_output
+import pbessolve_image
+import stage_profiler
+
+# vertex line of the PGSolver format: identifier priority owner successors "name";
+VERTEX_REGEX = re.compile(rb'^\s*(\d+)\s+(\d+)\s+([01])\s+([\d,]+)(?:\s+"([^"]*)")?\s*;')
+VERTEX_NAME_REGEX = re.compile(r'^X0(?:\(|@@|_)(\d+)(?:,\s*|#|_)(\d+)\)?$')
+
+# Parity game stored as arrays, successors in compressed sparse row format:
+# the successors of vertex v are targets[offsets[v]:offsets[v + 1]]
+class Parity_Game:
+    def __init__(self, priority, owner, offsets, targets, names) -> None:
+        self.priority = priority
+        self.owner = owner
+        self.offsets = offsets
+        self.targets = targets
+        self.names = names # maps vertex index to its name, only for named vertices
+        self.size = len(priority)
+        # predecessors in compressed sparse row format, for the attractor computation
+        sources = np.repeat(np.arange(self.size), np.diff(offsets))
+        order = np.argsort(targets, kind='stable')
+        self.predecessors = sources[order]
+        self.predecessor_offsets = np.searchsorted(targets[order], np.arange(self.size + 1))
+
+    def get_successors(self, vertex):
+        return self.targets[self.offsets[vertex]:self.offsets[vertex + 1]]
+
+    def get_predecessors(self, vertex):
+        return self.predecessors[self.predecessor_offsets[vertex]:self.predecessor_offsets[vertex + 1]]
+
+# Instantiate the PBES into a parity game in PGSolver format
+def export_parity_game(pbesfile):
+    pgfile = pbesfile.rsplit('.', 1)[0] + '.gm'
+    print(f'\n[pgsolve_image]    executing pbesinst on {pbesfile} ... \n')
+    with stage_profiler.stage('pbesinst', pgfile):
+        stage_profiler.run([pbessolve_image.mcrl2_tool('pbesinst'), pbesfile, pgfile, '--strategy=lazy', '--out=pgsolver', '--verbose'])
+    return pgfile
+
+# Parse a binary stream containing a parity game in PGSolver format
+def parse_pgsolver_stream(stream):
+    identifiers, priorities, owners, successors, names = [], [], [], [], {}
+    for line in stream:
+        vertex = VERTEX_REGEX.match(line)
+        if vertex is None: # header (parity n;) or empty line
+            continue
+        identifier, priority, owner, vertex_successors, name = vertex.groups()
+        if name is not None:
+            names[len(identifiers)] = name.decode('utf-8')
+        identifiers.append(int(identifier))
+        priorities.append(int(priority))
+        owners.append(int(owner))
+        successors.append(vertex_successors)
+
+    # map the identifiers of the file to dense indices
+    identifiers = np.array(identifiers, dtype=np.int64)
+    index = np.full(identifiers.max() + 1 if len(identifiers) else 0, -1, dtype=np.int64)
+    index[identifiers] = np.arange(len(identifiers))
+    counts = [vertex_successors.count(b',') + 1 for vertex_successors in successors]
+    offsets = np.zeros(len(successors) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    targets = index[np.array(b','.join(successors).split(b','), dtype=np.int64)] if successors else np.zeros(0, dtype=np.int64)
+
+    return Parity_Game(np.array(priorities, dtype=np.int64), np.array(owners, dtype=np.int8), offsets, targets, names)
+
+def parse_pgsolver_file(pgfile):
+    with open(pgfile, 'rb') as f:
+        return parse_pgsolver_stream(f)
+
+# Vertices in region from which player can force the play into target
+def attractor(game, region, player, target):
+    attracted = target & region
+    # amount of successors within the region that have not been attracted yet
+    remaining = np.add.reduceat(region[game.targets].astype(np.int64), game.offsets[:-1]) if len(game.targets) else np.zeros(game.size, dtype=np.int64)
+    remaining[game.offsets[:-1] == game.offsets[1:]] = 0 # reduceat does not handle vertices without successors
+    queue = list(np.nonzero(attracted)[0])
+    while queue:
+        vertex = queue.pop()
+        for predecessor in game.get_predecessors(vertex):
+            if not region[predecessor] or attracted[predecessor]:
+                continue
+            remaining[predecessor] -= 1
+            if game.owner[predecessor] == player or remaining[predecessor] == 0:
+                attracted[predecessor] = True
+                queue.append(predecessor)
+    return attracted
+
+# Zielonka's recursive algorithm on the subgame induced by region, the recursive call drops all
+# vertices of the maximum priority, so the recursion depth is bounded by the amount of distinct
+# priorities; the attractors B won by the opponent are removed in a loop instead of recursing
+# returns the winning regions of player 0 (even) and player 1 (odd)
+def zielonka(game, region):
+    won = [np.zeros_like(region), np.zeros_like(region)]
+    while region.any():
+        max_priority = game.priority[region].max()
+        player = max_priority % 2
+        top = region & (game.priority == max_priority)
+        A = attractor(game, region, player, top)
+        W = zielonka(game, region & ~A)
+        if not W[1 - player].any(): # player wins everywhere in region
+            won[player] |= region
+            break
+        B = attractor(game, region, 1 - player, W[1 - player])
+        won[1 - player] |= B
+        region = region & ~B
+    return tuple(won)
+
+# Solve the parity game (max-parity), vertices without successors are lost by their owner
+def solve_parity_game(game):
+    region = np.ones(game.size, dtype=bool)
+    dead_ends = game.offsets[:-1] == game.offsets[1:]
+    won_by_1 = attractor(game, region, 1, dead_ends & (game.owner == 0))
+    region &= ~won_by_1
+    won_by_0 = attractor(game, region, 0, dead_ends & (game.owner == 1))
+    region &= ~won_by_0
+    W0, W1 = zielonka(game, region)
+    return W0 | won_by_0, W1 | won_by_1
+
+# Coordinates of the target vertices won by player 0, i.e. the pixels that satisfy the formula
+def extract_solutions(game, W0):
+    true_coords = []
+    for vertex, name in game.names.items():
+        coords = VERTEX_NAME_REGEX.match(name)
+        if coords is not None and W0[vertex]:
+            true_coords.append((int(coords.group(1)), int(coords.group(2))))
+    return true_coords
+
+# Instantiate and solve the PBES, returns the pixel coordinates that satisfy the formula
+def solve_pbes(pbesfile):
+    pgfile = export_parity_game(pbesfile)
+    print(f'\n[pgsolve_image]    solving parity game {pgfile} ... ')
+    game = parse_pgsolver_file(pgfile)
+    W0, W1 = solve_parity_game(game)
+    return extract_solutions(game, W0)
+
+# Instantiate the PBES piped from lps2pbes and parse the parity game while pbesinst writes it, see pbessolve_image.Toolchain_Run
+def solve_piped(run, formula):
+    run.wait_linearisation()
+    print(f'\n[pgsolve_image]    executing lps2pbes on {run.lpsfile}, {formula} and pbesinst on its output ... \n')
+    with stage_profiler.stage('pbesinst'): # includes lps2pbes and parsing, which run concurrently
+        lps2pbes, pbesinst = run.pipe_pbes(formula, [pbessolve_image.mcrl2_tool('pbesinst'), '--strategy=lazy', '--out=pgsolver', '--verbose'])
+        game = parse_pgsolver_stream(pbesinst.stdout)
+        run.wait_pbes(lps2pbes, pbesinst, 'pbesinst')
+    print(f'\n[pgsolve_image]    solving parity game of {formula} ... ')
+    W0, W1 = solve_parity_game(game)
+    return extract_solutions(game, W0)
+
+# run optionally is a Toolchain_Run that already linearises the specification
+def do_pgsolve(specification, formula, run = None):
+    if run is not None:
+        true_coords = solve_piped(run, formula)
+    else:
+        with pbessolve_image.Toolchain_Run() as run:
+            run.linearise(specification)
+            true_coords = solve_piped(run, formula)
+
+    print(f'[pgsolve_image]    pixel coordinates that satisfy {formula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(allowed_extension, file):
+    if not file.endswith(allowed_extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {allowed_extension}')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("specification", help = "the mcrl2 specification of the image, in .mcrl2 format", type = lambda f: check_extension('.mcrl2', f))
+    parser.add_argument("formula", help = "the mu-calculus formula, in .mcf format", type = lambda f: check_extension('.mcf', f))
+    args = parser.parse_args()
+
+    true_coords = do_pgsolve(args.specification, args.formula)
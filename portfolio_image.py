@@ -0,0 +1,231 @@
+'''
+portfolio_image
+Races several pbessolve configurations on the same PBES and takes the first result
+
+The runtime of pbessolve varies by orders of magnitude with the shape of the formula, so
+instead of a single default configuration, a portfolio of configurations is started
+concurrently: different --strategy and --solve-strategy settings, optionally after
+simplifying the PBES with pbesconstelm and/or pbesparelm. The first configuration that
+finishes wins, and the processes of all others are killed. Every configuration runs in
+its own directory, so the evidence files of pbessolve do not collide.
+Jobs can be bounded by a time limit, after which all configurations are killed, and by a
+memory limit per process (the address space, on Unix). The winner is logged per formula
+class, the shape of the formula without its atomic propositions, to
+[CACHE_DIR]/portfolio_log.csv, see --summary for the configurations that won most often.
+
+The preprocessing tools keep the parameters x and y of X0, since every equation depends
+on the pixel it is evaluated in, so the results of all configurations are parsed alike.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import asyncio
+import csv
+import os
+import shutil
+import signal
+import subprocess
+import timeit
+from collections import Counter, defaultdict
+try:
+    import resource # memory limits, only available on Unix
+except ImportError:
+    resource = None
+
+# other scripts
+import artifact_cache
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+# configuration name -> (preprocessing tools applied in order, options of pbessolve)
+CONFIGURATIONS = {
+    'default': ([], []),
+    'strategy1': ([], ['--strategy=1']),
+    'strategy2': ([], ['--strategy=2']),
+    'solve1': ([], ['--solve-strategy=1']),
+    'constelm': (['pbesconstelm'], []),
+    'parelm_constelm': (['pbesparelm', 'pbesconstelm'], []),
+}
+PORTFOLIO = ['default', 'strategy1', 'solve1', 'parelm_constelm'] # configurations raced by default
+PORTFOLIO_LOG = os.path.join(artifact_cache.CACHE_DIR, 'portfolio_log.csv')
+LOG_FIELDS = ['formula class', 'winner', 'seconds', 'formula', 'failed']
+
+# Shape of the formula without its atomic propositions, e.g. (a S (N a))
+def formula_class(tree):
+    if tree.is_leaf():
+        return 'a'
+    if tree.value == None: # brackets
+        return formula_class(tree.left)
+    if slcs2modalmu.is_unary(tree.value):
+        return f'{tree.value} {formula_class(tree.right)}'
+    return f'({formula_class(tree.left)} {tree.value} {formula_class(tree.right)})'
+
+# Limits the address space of a child process to memory_limit MB, called in the child before executing the tool
+def limit_memory(memory_limit):
+    limit = memory_limit * 1024 * 1024
+    return lambda: resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+# Starts a tool in a process group of its own (on Unix), so it can be killed with all its children
+async def start_tool(arguments, memory_limit, **kwargs):
+    if memory_limit is not None and resource is not None:
+        kwargs['preexec_fn'] = limit_memory(memory_limit)
+    if os.name == 'posix':
+        kwargs['start_new_session'] = True
+    return await asyncio.create_subprocess_exec(*arguments, **kwargs)
+
+def kill_tool(process):
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError: # already exited
+        pass
+
+# Kills a tool that is still running, e.g. when its configuration is cancelled
+async def stop_tool(process):
+    if process.returncode is None:
+        kill_tool(process)
+        await process.wait()
+
+async def finish_tool(process, name):
+    try:
+        await process.wait()
+    finally:
+        await stop_tool(process)
+    if process.returncode != 0:
+        raise RuntimeError(f'{name} exited with code {process.returncode}')
+
+# Solves the PBES with a single configuration in its own directory
+# returns the pixel coordinates that satisfy the formula
+async def solve_configuration(name, lpsfile, pbesfile, directory, memory_limit):
+    preprocessing, options = CONFIGURATIONS[name]
+    os.makedirs(directory)
+    current = os.path.join(directory, 'formula.pbes')
+    try:
+        os.link(pbesfile, current)
+    except OSError:
+        shutil.copyfile(pbesfile, current)
+    for tool in preprocessing:
+        output = os.path.join(directory, f'{tool}.pbes')
+        process = await start_tool([pbessolve_image.mcrl2_tool(tool), current, output], memory_limit,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        await finish_tool(process, tool)
+        current = output
+
+    process = await start_tool([pbessolve_image.mcrl2_tool('pbessolve'), current, f'--file={os.path.realpath(lpsfile)}', *options, '--verbose', '--debug'],
+                               memory_limit, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    parser = pbessolve_image.Pbessolve_Output_Parser()
+    try:
+        while True:
+            chunk = await process.stdout.read(pbessolve_image.CHUNK_SIZE)
+            if not chunk: # end of stream
+                parser.close()
+                break
+            if not parser.finished: # drain remaining output so pbessolve can finish writing the evidence
+                parser.feed(chunk)
+        await finish_tool(process, 'pbessolve')
+    finally:
+        await stop_tool(process)
+    return pbessolve_image.extract_solutions(parser.get_equations())
+
+# Starts all configurations and returns the name and result of the first one that succeeds
+# returns the failures of configurations that finished earlier as well
+async def race(lpsfile, pbesfile, configurations, directory, time_limit = None, memory_limit = None):
+    loop = asyncio.get_running_loop()
+    tasks = {asyncio.create_task(solve_configuration(name, lpsfile, pbesfile, os.path.join(directory, name), memory_limit)): name
+             for name in configurations}
+    pending = set(tasks)
+    deadline = None if time_limit is None else loop.time() + time_limit
+    failures = {}
+    try:
+        while pending:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f'no configuration finished within {time_limit} seconds')
+            for task in done:
+                if task.exception() is None:
+                    return tasks[task], task.result(), failures
+                failures[tasks[task]] = task.exception()
+        raise RuntimeError('all configurations failed: ' + ', '.join(f'{name}: {error}' for name, error in failures.items()))
+    finally: # kill the processes of the configurations that lost
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+def log_winner(logfile, record):
+    os.makedirs(os.path.dirname(logfile) or '.', exist_ok=True)
+    new = not os.path.exists(logfile)
+    with open(logfile, 'a', newline='') as file:
+        writer = csv.DictWriter(file, LOG_FIELDS)
+        if new:
+            writer.writeheader()
+        writer.writerow(record)
+
+# Counts the wins of every configuration per formula class
+def summarize_log(logfile):
+    wins = defaultdict(Counter)
+    with open(logfile, newline='') as file:
+        for record in csv.DictReader(file):
+            wins[record['formula class']][record['winner']] += 1
+    return wins
+
+# run optionally is a Toolchain_Run whose scratch directory already holds the specification and formula
+def do_portfolio(specification, formula, SLCS_Ast, configurations = PORTFOLIO, time_limit = None, memory_limit = None, logfile = PORTFOLIO_LOG, run = None):
+    if run is None:
+        with pbessolve_image.Toolchain_Run() as run:
+            return do_portfolio(specification, formula, SLCS_Ast, configurations, time_limit, memory_limit, logfile, run)
+    # every configuration needs the .pbes as file, in the scratch directory of the run
+    (lpsfile, pbesfile) = pbessolve_image.execute_prelim_mCRL2(specification, formula, run.directory) # execute mcrl22lps and lps2pbes
+    print(f'\n[portfolio_image]    racing {", ".join(configurations)} on {pbesfile} ... ')
+    start_time = timeit.default_timer()
+    winner, true_coords, failures = asyncio.run(race(lpsfile, pbesfile, configurations, run.directory, time_limit, memory_limit))
+    elapsed = timeit.default_timer() - start_time
+
+    log_winner(logfile, {'formula class': formula_class(SLCS_Ast), 'winner': winner, 'seconds': f'{elapsed:.3f}',
+                         'formula': formula, 'failed': ' '.join(failures)})
+    print(f'[portfolio_image]    {winner} finished first after {elapsed:.3f} seconds')
+    print(f'[portfolio_image]    pixel coordinates that satisfy {formula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension, nargs = '?')
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f), nargs = '?')
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python and report them as actions ap_i in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--configurations", help = "pbessolve configurations to race", nargs = '+', choices = list(CONFIGURATIONS), default = PORTFOLIO)
+    parser.add_argument("--timelimit", help = "seconds after which all configurations are killed", type = float)
+    parser.add_argument("--memorylimit", help = "address space of every tool in MB (Unix only)", type = int)
+    parser.add_argument("--log", help = "file the winners are logged to, in .csv format", default = PORTFOLIO_LOG)
+    parser.add_argument("--summary", help = "print the configurations that won most often per formula class and exit", action = "store_true")
+    args = parser.parse_args()
+
+    if args.summary:
+        for formula, wins in summarize_log(args.log).items():
+            print(f'[portfolio_image]    {formula}: ' + ', '.join(f'{name} {count}x' for name, count in wins.most_common()))
+    elif args.image is None or args.slcsformula is None:
+        parser.error('an image and a formula are required')
+    else:
+        predicates, propositions = native_image.precompute_atomic_predicates(args.image, args.slcsformula, args.greyscale) if args.atoms else (None, None)
+        mcrl2file = image2mcrl2.create_mcrl2_specification(args.image, args.greyscale, propositions = propositions)
+        mcffile = slcs2modalmu.translate_SLCS_formula(args.slcsformula, args.greyscale, True, predicates)
+        SLCS_Ast = slcs2modalmu.parse_SLCS_formula(args.slcsformula, args.greyscale, True)
+        true_coords = do_portfolio(mcrl2file, mcffile, SLCS_Ast, args.configurations, args.timelimit, args.memorylimit, args.log)
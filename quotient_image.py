@@ -0,0 +1,184 @@
+'''
+quotient_image
+Verifies a SLCS formula on a quotient of an image, instead of on every pixel
+
+The quotient is specific to the formula. Starting from the connected components of
+the valuation of its atomic propositions, the blocks are refined once per nesting level
+of N: all pixels of a block get the same set of blocks in their neighbourhood, and every
+block is split into its connected components again. On the resulting partition every
+subformula is constant: N because the blocks are stable up to the N depth of the formula,
+S because its value is constant on every connected set of pixels satisfying phi_1, and a
+path in the quotient can be taken within connected blocks by the pixels themselves.
+The quotient specification has one state Block(b) per block with an R transition to
+every block adjacent to it, and the verdict of a block is mapped back to all its pixels.
+
+A full bisimulation would separate the pixels of a uniform region by their distance to
+every other region, so on images it hardly reduces the amount of states. Here, uniform
+regions only split into rings of at most the N depth around their borders.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import io
+import os
+import numpy as np
+
+# other scripts
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+# Neighbouring values (4-neighbourhood in 2D) of every element of an array, as extra last axis
+# the value itself takes the place of neighbours outside the array
+def neighbourhood(values):
+    padded = np.pad(values, 1, mode='edge')
+    center = tuple(slice(1, -1) for _ in range(values.ndim))
+    neighbours = [values]
+    for axis in range(values.ndim):
+        for offset in (-1, 1):
+            shifted = list(center)
+            shifted[axis] = slice(1 + offset, padded.shape[axis] - 1 + offset)
+            neighbours.append(padded[tuple(shifted)])
+    return np.stack(neighbours, axis=-1)
+
+# Refines the blocks once, such that all pixels of a block have the same set of blocks in their neighbourhood
+# returns the dense block index of every pixel
+def refine_blocks(blocks):
+    # the set of blocks in the neighbourhood, duplicates are replaced by -1 and sorted to the front
+    neighbours = np.sort(neighbourhood(blocks).reshape(blocks.size, -1), axis=1)
+    neighbours[:, 1:][neighbours[:, 1:] == neighbours[:, :-1]] = -1
+    neighbours.sort(axis=1)
+    signatures = np.column_stack((blocks.ravel(), neighbours))
+    return np.unique(signatures, axis=0, return_inverse=True)[1].reshape(blocks.shape)
+
+# Splits every block into its connected components (4-neighbourhood)
+# returns the dense block index of every pixel
+def split_components(blocks):
+    index = np.arange(blocks.size).reshape(blocks.shape)
+    sources, targets = [], []
+    for axis in range(blocks.ndim): # edges between neighbouring pixels of the same block
+        lower = [slice(None)] * blocks.ndim
+        upper = [slice(None)] * blocks.ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        lower, upper = tuple(lower), tuple(upper)
+        same = blocks[lower] == blocks[upper]
+        sources.append(index[lower][same])
+        targets.append(index[upper][same])
+    parent = native_image.union_find(blocks.size, np.concatenate(sources), np.concatenate(targets))
+    return np.unique(parent, return_inverse=True)[1].reshape(blocks.shape)
+
+# Partition of the pixels into connected blocks on which every subformula of N depth at most depth is constant
+# every round makes N of the subformulae of the previous round constant, every split does so for S
+# returns the dense block index of every pixel and the amount of blocks
+def quotient_partition(classes, depth):
+    blocks = split_components(classes)
+    for _ in range(depth):
+        refined = split_components(refine_blocks(blocks))
+        if refined.max() == blocks.max(): # stable, further rounds do not refine
+            break
+        blocks = refined
+    return blocks, blocks.max() + 1
+
+# Pairs of blocks (b, c) with an R transition from the pixels of b to pixels of c, including self-loops
+def quotient_transitions(blocks):
+    neighbours = neighbourhood(blocks)
+    pairs = np.column_stack((np.repeat(blocks.ravel(), neighbours.shape[-1]), neighbours.ravel()))
+    return np.unique(pairs, axis=0)
+
+# Writes the .mcrl2 specification of the quotient to a file
+# valuations has one row of booleans per block, stating which propositions hold in the block
+def write_mCRL2_quotient_spec(transitions, valuations, start, file):
+    file.write(f'''map
+	neighbours: Nat -> List(Nat);
+	holds: Nat # Nat -> Bool;
+	start_b: Nat;
+	size_b: Nat;
+    ''')
+    file.write(f'''
+eqn ''')
+    bounds = np.searchsorted(transitions[:, 0], np.arange(len(valuations) + 1))
+    for block in range(len(valuations)):
+        successors = transitions[bounds[block]:bounds[block + 1], 1]
+        file.write(f'''
+    neighbours({block}) = [{', '.join(map(str, successors.tolist()))}];''')
+    for block, valuation in enumerate(valuations.tolist()):
+        for proposition, value in enumerate(valuation):
+            file.write(f'''
+    holds({proposition}, {block}) = {'true' if value else 'false'};''')
+    file.write(f'''
+    start_b = {start};
+    size_b = {len(valuations) - 1};''')
+    actions = ', '.join(['R'] + [f'ap_{proposition}' for proposition in range(valuations.shape[1])])
+    reports = ''.join(f'''
+    + holds({proposition}, b) -> ap_{proposition} . Block(b) ''' for proposition in range(valuations.shape[1]))
+    file.write(f'''
+act
+    {actions};
+proc
+Block(b: Nat) =
+    (sum c: Nat . (c <= size_b && c in neighbours(b)) -> R . Block(c)) {reports}
+;
+init
+    allow ({{{actions}}},
+    comm(
+        {{}}, Block(start_b)
+    )
+);''') # double braces to escape { } characters in f-string
+
+# Builds the quotient of the image for the given proposition masks
+# returns the block index of every pixel and the .mcrl2 specification
+def build_quotient(propositions, depth):
+    classes, indices = image2mcrl2.build_proposition_classes(propositions)
+    blocks, count = quotient_partition(indices, depth)
+    valuations = np.zeros((count, len(propositions)), dtype=bool)
+    valuations[blocks.ravel()] = classes[indices.ravel()] # every pixel of a block has the same valuation
+    output = io.StringIO()
+    write_mCRL2_quotient_spec(quotient_transitions(blocks), valuations, blocks.flat[0], output)
+    result = output.getvalue()
+    output.close()
+    return blocks, result
+
+def do_quotient(imagefile, SLCSformula, greyscale, optimize = False):
+    predicates, propositions = native_image.precompute_atomic_predicates(imagefile, SLCSformula, greyscale)
+    keys = {slcs2modalmu.proposition_key(predicate) for predicate in predicates} # distance predicates are precomputed
+    depth = slcs2modalmu.near_depth(slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True), keys)
+    blocks, specification = build_quotient(propositions, depth)
+    with pbessolve_image.Toolchain_Run() as run: # all files are written to a scratch directory of this run only
+        mcrl2file = os.path.join(run.directory, os.path.basename(imagefile).rsplit('.', 1)[0] + '_quotient.mcrl2')
+        with open(mcrl2file, 'w') as file:
+            file.write(specification)
+        print(f'[quotient_image]    reduced {blocks.size} pixels to {blocks.max() + 1} blocks, saved quotient specification to {mcrl2file}')
+        run.linearise(mcrl2file) # mcrl22lps runs while the formula is translated
+
+        mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates, optimize, os.path.join(run.directory, os.path.basename(SLCSformula)[:-5]))
+        true_blocks = [coords[0] for coords in pbessolve_image.do_pbessolve(mcrl2file, mcffile, run)] # vertices X0(b)
+    true_coords = native_image.mask_to_coords(np.isin(blocks, true_blocks))
+
+    print(f'[quotient_image]    pixel coordinates that satisfy {SLCSformula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    args = parser.parse_args()
+
+    true_coords = do_quotient(args.image, args.slcsformula, args.greyscale, args.optimize)
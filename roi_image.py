@@ -0,0 +1,59 @@
+'''
+roi_image
+Restricts the verification of a formula to a region of interest (ROI) of the image
+
+Often only the verdicts within a bounding box or a mask are needed, e.g. for a lesion
+candidate. Instead of [true*], which makes pbessolve decide the formula in every pixel,
+the specification gets an initial state with a start transition to every pixel of the
+region (see image2mcrl2.write_roi_process) and the formula is prefixed by [start]. The
+tools only instantiate the pixels of the region and the pixels their subformulae reach,
+e.g. via N or the paths of S, so reachability outside the region is still respected.
+The native engine evaluates the whole image and applies the region as a mask.
+
+A region is given as box x0,y0,x1,y1 (inclusive, like the boxes export of image_output),
+as mask image in which the nonzero pixels form the region, or as .npy/.npz mask saved
+by --export.
+'''
+import argparse
+import re
+import numpy as np
+from PIL import Image
+
+import image_output
+
+BOX_REGEX = re.compile(r'\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*')
+
+# Argument type of --roi, returns a box (x0, y0, x1, y1) or the path of a mask file
+def parse_roi(text):
+    box = BOX_REGEX.fullmatch(text)
+    if box:
+        x0, y0, x1, y1 = (int(value) for value in box.groups())
+        if x0 > x1 or y0 > y1:
+            raise argparse.ArgumentTypeError('empty box, expected x0,y0,x1,y1 with x0 <= x1 and y0 <= y1')
+        return (x0, y0, x1, y1)
+    if text.rsplit('.', 1)[-1] not in ('png', 'jpg', 'jpeg', 'npy', 'npz'):
+        raise argparse.ArgumentTypeError('expected a box x0,y0,x1,y1 or a mask, allowed formats: png, jpg, jpeg, npy, npz')
+    return text
+
+# Boolean mask of shape (height, width) of a region given as box or mask file, see parse_roi
+def roi_mask(roi, shape):
+    if isinstance(roi, tuple):
+        x0, y0, x1, y1 = roi
+        mask = np.zeros(shape, dtype=bool)
+        mask[y0:y1 + 1, x0:x1 + 1] = True # clipped to the image
+    elif roi.endswith(('.npy', '.npz')):
+        mask = image_output.load_mask(roi).astype(bool)
+    else:
+        with Image.open(roi) as im:
+            data = np.asarray(im)
+        mask = data.any(axis=-1) if data.ndim == 3 else data != 0
+    if mask.shape != tuple(shape):
+        raise ValueError(f'the region of interest has shape {mask.shape}, expected {tuple(shape)}')
+    if not mask.any():
+        raise ValueError('the region of interest contains no pixels')
+    return mask
+
+# Keeps the (x, y) coordinates that lie within the region
+def restrict_coords(true_coords, mask):
+    height, width = mask.shape
+    return [(x, y) for (x, y) in true_coords if x < width and y < height and mask[y, x]]
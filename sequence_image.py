@@ -0,0 +1,181 @@
+'''
+sequence_image
+Verifies a SLCS formula on a sequence of frames (or successive edits of an image) incrementally
+
+The first frame is evaluated completely by the native engine, keeping the satisfaction
+mask of every subformula. For every next frame, only the box around the changed pixels
+is re-evaluated: atomic propositions and boolean operators keep the box of their operands,
+N grows it by one pixel, and S extends it until it encloses all components of phi_1 that
+touch the grown box, since the value of S changes for a whole component at once. All
+pixels outside these boxes keep their previous masks, so the work per frame depends on
+the size of the change rather than on the size of the frame.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import timeit
+import numpy as np
+
+# other scripts
+import batch_image
+import native_image
+import slcs2modalmu
+
+# Boxes are (y0, y1, x0, x1) tuples, None is the empty box
+def union_box(box_1, box_2):
+    if box_1 is None or box_2 is None:
+        return box_1 if box_2 is None else box_2
+    return (min(box_1[0], box_2[0]), max(box_1[1], box_2[1]), min(box_1[2], box_2[2]), max(box_1[3], box_2[3]))
+
+def grow_box(box, margin, shape):
+    y0, y1, x0, x1 = box
+    return (max(y0 - margin, 0), min(y1 + margin, shape[0]), max(x0 - margin, 0), min(x1 + margin, shape[1]))
+
+def box_slice(box):
+    return (slice(box[0], box[1]), slice(box[2], box[3]))
+
+# Smallest box containing all pixels of the mask
+def mask_box(mask):
+    rows, columns = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+    if len(rows) == 0:
+        return None
+    return (rows[0], rows[-1] + 1, columns[0], columns[-1] + 1)
+
+# Recomputes phi_1 S phi_2 within and around the seed box, in place
+# returns the box of pixels whose value may have changed
+def update_surround(mask, phi_1, phi_2, seed):
+    shape = mask.shape
+    box = seed
+    while True: # grow the box until the components touching the seed do not reach its inner borders
+        labels = native_image.label_components(phi_1[box_slice(box)])
+        relative = (seed[0] - box[0], seed[1] - box[0], seed[2] - box[2], seed[3] - box[2])
+        touched = np.unique(labels[box_slice(relative)])
+        touched = touched[touched != labels.size]
+        in_touched = np.isin(labels, touched)
+        borders = (box[0] > 0 and in_touched[0].any(), box[1] < shape[0] and in_touched[-1].any(),
+                   box[2] > 0 and in_touched[:, 0].any(), box[3] < shape[1] and in_touched[:, -1].any())
+        if not any(borders):
+            break
+        height, width = box[1] - box[0], box[3] - box[2]
+        box = (box[0] - height if borders[0] else box[0], box[1] + height if borders[1] else box[1],
+               box[2] - width if borders[2] else box[2], box[3] + width if borders[3] else box[3])
+        box = grow_box(box, 0, shape) # clip to the frame
+
+    # escape routes of the touched components, which lie completely within the box
+    margin = grow_box(box, 1, shape)
+    escape = native_image.near(~(phi_1[box_slice(margin)] | phi_2[box_slice(margin)])) & phi_1[box_slice(margin)]
+    escape = escape[box[0] - margin[0]:box[1] - margin[0], box[2] - margin[2]:box[3] - margin[2]]
+    escaped = np.unique(labels[escape & in_touched])
+
+    region = mask[box_slice(box)]
+    region[box_slice(relative)] &= phi_1[box_slice(seed)] # pixels of the seed outside phi_1
+    region[in_touched] = ~np.isin(labels[in_touched], escaped)
+    return box
+
+# Keeps the masks of all subformulae of the previous frame and updates them for the next frame
+class Incremental_Verifier:
+    def __init__(self, tree) -> None:
+        self.tree = tree
+        self.pixels = None # pixels of the previous frame
+        self.masks = {} # maps nodes to their masks, see native_image.evaluate_tree
+
+    # Computes the satisfaction mask of the formula on the next frame
+    def verify(self, pixels):
+        if self.pixels is None or self.pixels.shape != pixels.shape: # first frame, evaluate completely
+            self.masks = {}
+            mask = native_image.evaluate_tree(self.tree, pixels, self.masks)
+            changed = pixels.shape[0] * pixels.shape[1]
+        else:
+            changed_pixels = (pixels != self.pixels).any(axis=-1)
+            changed = int(np.count_nonzero(changed_pixels))
+            self.update(self.tree, pixels, mask_box(changed_pixels), {})
+            mask = self.masks[id(self.tree)]
+        self.pixels = pixels
+        return mask, changed
+
+    # Updates the mask of the (sub)formula within the box of changed pixels
+    # returns the box of pixels whose value may have changed, boxes maps nodes to their returned box
+    def update(self, tree, pixels, changed, boxes):
+        if id(tree) in boxes:
+            return boxes[id(tree)]
+        mask = self.masks[id(tree)]
+        shape = mask.shape
+        if tree.is_leaf(): # atomic proposition
+            box = changed
+            if box is not None:
+                mask[box_slice(box)] = native_image.atom_mask(pixels[box_slice(box)], tree.value)
+        else:
+            box_1 = self.update(tree.left, pixels, changed, boxes) if tree.left is not None else None
+            box_2 = self.update(tree.right, pixels, changed, boxes) if tree.right is not None else None
+            box = union_box(box_1, box_2)
+            phi_1 = self.masks[id(tree.left)] if tree.left is not None else None
+            phi_2 = self.masks[id(tree.right)] if tree.right is not None else None
+            if box is None or tree.value == None: # unchanged, or brackets sharing the mask of their subformula
+                pass
+            elif tree.value == '!':
+                mask[box_slice(box)] = ~phi_2[box_slice(box)]
+            elif tree.value == '&&':
+                mask[box_slice(box)] = phi_1[box_slice(box)] & phi_2[box_slice(box)]
+            elif tree.value == '||':
+                mask[box_slice(box)] = phi_1[box_slice(box)] | phi_2[box_slice(box)]
+            elif tree.value == 'N':
+                box = grow_box(box, 1, shape)
+                margin = grow_box(box, 1, shape)
+                near = native_image.near(phi_2[box_slice(margin)])
+                mask[box_slice(box)] = near[box[0] - margin[0]:box[1] - margin[0], box[2] - margin[2]:box[3] - margin[2]]
+            elif slcs2modalmu.is_unary(tree.value): # N^k and D[<=k], depending on the pixels within distance k
+                k = slcs2modalmu.near_bound(tree.value) or slcs2modalmu.distance_bound(tree.value)
+                box = grow_box(box, k, shape)
+                margin = grow_box(box, k, shape)
+                if slcs2modalmu.near_bound(tree.value) is not None:
+                    within = native_image.near_within(phi_2[box_slice(margin)], k)
+                else:
+                    within = native_image.distance_within(phi_2[box_slice(margin)], k)
+                mask[box_slice(box)] = within[box[0] - margin[0]:box[1] - margin[0], box[2] - margin[2]:box[3] - margin[2]]
+            elif tree.value == 'S':
+                box = update_surround(mask, phi_1, phi_2, grow_box(box, 1, shape))
+            else:
+                raise SyntaxError(f'Operator \'{tree.value}\' is not supported by the native engine')
+        boxes[id(tree)] = box
+        return box
+
+def do_sequence(imagefiles, SLCSformula, greyscale, optimize = False, mark_colour = batch_image.MARK_COLOUR):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True) # atomic propositions in mcrl2 format
+    if optimize:
+        SLCS_Ast = slcs2modalmu.optimize_tree(SLCS_Ast)
+    verifier = Incremental_Verifier(SLCS_Ast)
+
+    frame_coords = []
+    for imagefile in imagefiles:
+        start_time = timeit.default_timer()
+        mask, changed = verifier.verify(native_image.load_pixels(imagefile, greyscale))
+        true_coords = native_image.mask_to_coords(mask)
+        elapsed = timeit.default_timer() - start_time
+        marked_imagefile = batch_image.save_marked_image(imagefile, SLCSformula, true_coords, mark_colour)
+        print(f'[sequence_image]    {imagefile}: {changed} changed pixels, {len(true_coords)} pixels satisfy the formula ({elapsed:.3f} seconds), saved marked image to {marked_imagefile}')
+        frame_coords.append(true_coords)
+
+    return frame_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("frames", help = "the frames of the sequence in order, allowed formats: png, jpg, jpeg", type=check_image_extension, nargs = '+')
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--markcolour", help = "set a custom mark colour with three integers representing its RGB value", nargs=3, type=int, default = batch_image.MARK_COLOUR)
+    parser.add_argument("--optimize", help = "evaluate common subformulae only once", action = "store_true")
+    args = parser.parse_args()
+
+    frame_coords = do_sequence(args.frames, args.slcsformula, args.greyscale, args.optimize, tuple(args.markcolour))
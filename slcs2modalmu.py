@@ -8,10 +8,14 @@ For more information regarding structure of SLCS formulae, see the documentation
 import re
 import argparse
 
+import stage_profiler
+
 OPERATORS = ['S', 'N', '&&', '||', '!']
+BOUNDED_OPERATORS = '(?:N\s?\^\s?\d+|D\s?\[\s?<=\s?\d+\s?\])' # N^k and D[<=k], tokens of the lexer
 COMMENT = '%'
 MCRL2 = False # global whether mcrl2 is used
 GREYSCALE = False # default for optimization monochromatic images
+PROPOSITIONS = {} # maps keys of precomputed (sub)formulae to the index i of their action ap_i
 
 # Binary tree implementation
 class Node:
@@ -53,6 +57,22 @@ class Node:
             return f'{valuePrint}[{leftPrint}, {rightPrint}]'  
 
 
+# Bound k of the bounded near operator N^k, N is N^1, None for other values
+def near_bound(value):
+    if value == 'N':
+        return 1
+    match = re.fullmatch('N\^(\d+)', value) if isinstance(value, str) else None
+    return int(match.group(1)) if match else None
+
+# Bound k of the distance operator D[<=k], None for other values
+def distance_bound(value):
+    match = re.fullmatch('D\[<=(\d+)\]', value) if isinstance(value, str) else None
+    return int(match.group(1)) if match else None
+
+# Whether the operator has a single operand, which is its right child
+def is_unary(value):
+    return value == '!' or near_bound(value) is not None or distance_bound(value) is not None
+
 # Builds an AST based on an SLCS formula
 # Returns the root node object
 def build_SLCS_AST(SLCSFormula):
@@ -69,17 +89,19 @@ def build_SLCS_AST(SLCSFormula):
             # lexer, tokenizes the current line based on syntax, [123-123,123-123,123-123] for atomic propositions
             if MCRL2: 
                 if GREYSCALE: # find only one range for monochromatic images
-                    tokenList = re.findall('\[\s?\d+\s?\-\s?\d+\s?\]|[S]|[N]|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
+                    tokenList = re.findall(BOUNDED_OPERATORS + '|\[\s?\d+\s?\-\s?\d+\s?\]|[S]|[N]|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
                 else:
-                    tokenList = re.findall('\[\s?\d+\\s?-\s?\d+\s?\,\s?\d+\s?\-\s?\d+\s?\,\s?\d+\s?\-\s?\d+\s?\]|[S]|[N]|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
+                    tokenList = re.findall(BOUNDED_OPERATORS + '|\[\s?\d+\\s?-\s?\d+\s?\,\s?\d+\s?\-\s?\d+\s?\,\s?\d+\s?\-\s?\d+\s?\]|[S]|[N]|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
             else:
-                tokenList = re.findall('[\w+]+|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
+                tokenList = re.findall(BOUNDED_OPERATORS + '|[\w+]+|[&]{2}|[\|\|]{2}|[(|)|!|%]', line, re.ASCII)
             for token in tokenList:
                 # end line if comment is encountered, see for-else block
                 if token == COMMENT: 
                     break
+                if re.fullmatch(BOUNDED_OPERATORS, token):
+                    token = re.sub('\s', '', token) # N^k or D[<=k] without whitespace
                 # move up in case node is already filled (nested single term operators)
-                if cur_node.value == 'N' or cur_node.value == '!': 
+                if is_unary(cur_node.value): 
                     cur_node = cur_node.parent
                 # beginning of new subformula, insert left node and traverse to it
                 if token == '(': 
@@ -93,7 +115,7 @@ def build_SLCS_AST(SLCSFormula):
                     cur_node = cur_node.parent 
                 # token is an operator, insert right node and traverse to it 
                 # operators with one term therefore have no left child 
-                elif token in OPERATORS: 
+                elif token in OPERATORS or is_unary(token): 
                     cur_node.set_val(token)
                     # S and && should have two arguments
                     if token == 'S' or token == '&&' or token == '||':
@@ -101,8 +123,8 @@ def build_SLCS_AST(SLCSFormula):
                             raise SyntaxError(f'Operator \'{cur_node.value}\' has no preceding argument')
                         if cur_node.right is not None:
                             raise SyntaxError(f'Operator \'{cur_node.value}\' has no preceding argument')
-                    # N and ! should only have one argument
-                    if token == 'N' or token == '!':
+                    # N, N^k, D[<=k] and ! should only have one argument
+                    if is_unary(token):
                         if cur_node.left is not None:
                             raise SyntaxError(f'Operator \'{cur_node.value}\' has an invalid preceding argument')
                     cur_node.insert_right()
@@ -122,25 +144,148 @@ def build_SLCS_AST(SLCSFormula):
     
     return tree
 
-# Creates a modal-mu formula from the AST of the SLCS formula
-def modal_mu_from_tree(tree):
-    if tree.is_leaf(): # Handle atomic propositions
-        if MCRL2:
-            if GREYSCALE: # optimization for monochromatic images
-                RGB_values = re.search('(\d+)\s?-\s?(\d+)', tree.value).groups()
-                grey_min, grey_max = RGB_values[0], RGB_values[1]
-                return f"""(exists px:Pixel . val({grey_min} <= px && px <= {grey_max}) && <report(px)>true)\n"""
-            else:
-                RGB_values = re.search('(\d+)\s?-\s?(\d+)\s?,\s?(\d+)\s?-\s?(\d+)\s?,\s?(\d+)\s?-\s?(\d+)', tree.value).groups()
-                red_min, red_max = RGB_values[0], RGB_values[1]
-                green_min, green_max = RGB_values[2], RGB_values[3]
-                blue_min, blue_max = RGB_values[4], RGB_values[5]
-                return f"""(exists px:Pixel . val(
+# Extracts the (min, max) intensity pairs of an mCRL2 atomic proposition
+# one pair for monochromatic images, three pairs (red, green, blue) otherwise
+def atomic_ranges(value):
+    RGB_values = re.findall('(\d+)\s?-\s?(\d+)', value)
+    ranges = [(int(low), int(high)) for low, high in RGB_values]
+    return ranges[:1] if GREYSCALE else ranges[:3]
+
+# Key identifying a precomputed proposition, i.e. the canonical form of the (sub)formula
+def proposition_key(tree):
+    return canonical_form(tree)
+
+# Canonical string representation of a (sub)formula
+# brackets and whitespace are ignored, operands of commutative operators are sorted
+def canonical_form(tree):
+    if tree.is_leaf():
+        return re.sub('\s', '', tree.value)
+    phi_1 = canonical_form(tree.left) if tree.left is not None else None
+    phi_2 = canonical_form(tree.right) if tree.right is not None else None
+    if tree.value == None: # brackets
+        return phi_1
+    elif is_unary(tree.value):
+        return f'{tree.value}({phi_2})'
+    elif tree.value in ('&&', '||'):
+        phi_1, phi_2 = sorted((phi_1, phi_2))
+    return f'({phi_1} {tree.value} {phi_2})'
+
+# Amount of operators and atomic propositions in the (sub)formula, brackets excluded
+def count_nodes(tree):
+    children = sum(count_nodes(child) for child in (tree.left, tree.right) if child is not None)
+    return children if tree.value is None else children + 1
+
+# Largest amount of nested N operators in the (sub)formula, i.e. the distance in pixels up to which
+# its satisfaction in a pixel depends on other pixels, apart from the reachability of S
+# N^k and D[<=k] count as k nested N operators
+# subformulae whose key is in propositions are precomputed and count as atomic
+def near_depth(tree, propositions = ()):
+    if tree.is_leaf() or proposition_key(tree) in propositions:
+        return 0
+    depth = max(near_depth(child, propositions) for child in (tree.left, tree.right) if child is not None)
+    bound = near_bound(tree.value) if distance_bound(tree.value) is None else distance_bound(tree.value)
+    return depth + bound if bound is not None else depth
+
+# Collects the distinct atomic propositions of the AST, in order of appearance
+# distance predicates D[<=k] are collected as a whole, since they are computed in Python by a distance transform
+def collect_atomic_predicates(tree, predicates = None):
+    if predicates is None:
+        predicates = {}
+    if tree.is_leaf() or distance_bound(tree.value) is not None:
+        predicates.setdefault(proposition_key(tree), tree)
+        return list(predicates.values())
+    for child in (tree.left, tree.right):
+        if child is not None:
+            collect_atomic_predicates(child, predicates)
+    return list(predicates.values())
+
+# Creates a node with the given children, without parent
+def make_node(value, left = None, right = None):
+    node = Node(value)
+    node.left, node.right = left, right
+    return node
+
+# Collects the operands of a chain of the same associative operator, e.g. a && (b && c)
+def collect_operands(tree, operator, operands):
+    if tree.value == operator and not tree.is_leaf():
+        collect_operands(tree.left, operator, operands)
+        collect_operands(tree.right, operator, operands)
+    else:
+        operands.append(tree)
+    return operands
+
+# Intersection of two atomic propositions, the conjunction of their ranges
+def merge_ranges(value_1, value_2):
+    ranges = zip(atomic_ranges(value_1), atomic_ranges(value_2))
+    return ','.join(f'{max(low_1, low_2)}-{min(high_1, high_2)}' for (low_1, high_1), (low_2, high_2) in ranges)
+
+# Optimizes the AST of a SLCS formula, the result is a DAG in which equal subformulae are a single node
+# removes brackets and double negations, merges conjunctions of atomic propositions into one range
+# and removes duplicate operands of && and ||
+def optimize_tree(tree, shared = None):
+    if shared is None:
+        shared = {} # maps canonical forms to their unique node
+    if tree.is_leaf():
+        node = make_node(re.sub('\s', '', tree.value))
+    elif tree.value == None: # brackets
+        return optimize_tree(tree.left, shared)
+    elif tree.value == '!' and tree.right.value == '!' and not tree.right.is_leaf(): # double negation
+        return optimize_tree(tree.right.right, shared)
+    elif tree.value in ('&&', '||'):
+        operands = {} # distinct operands of the chain, in order of appearance
+        for operand in collect_operands(tree, tree.value, []):
+            operand = optimize_tree(operand, shared)
+            for nested in collect_operands(operand, tree.value, []):
+                operands.setdefault(canonical_form(nested), nested)
+        operands = list(operands.values())
+        atoms = [operand for operand in operands if operand.is_leaf()]
+        # merge ranges of all atomic conjuncts, unless the atomic propositions are precomputed by the model
+        if tree.value == '&&' and len(atoms) > 1 and MCRL2 and not PROPOSITIONS:
+            value = atoms[0].value
+            for atom in atoms[1:]:
+                value = merge_ranges(value, atom.value)
+            merged = shared.setdefault(value, make_node(value))
+            operands = [merged] + [operand for operand in operands if not operand.is_leaf()]
+        node = operands[0]
+        for operand in operands[1:]:
+            node = shared.setdefault(canonical_form(make_node(tree.value, node, operand)), make_node(tree.value, node, operand))
+        return node
+    else:
+        left = optimize_tree(tree.left, shared) if tree.left is not None else None
+        right = optimize_tree(tree.right, shared) if tree.right is not None else None
+        node = make_node(tree.value, left, right)
+    return shared.setdefault(canonical_form(node), node)
+
+# Modal mu-formula of an atomic proposition
+def atomic_formula(tree):
+    if MCRL2:
+        if GREYSCALE: # optimization for monochromatic images
+            RGB_values = re.search('(\d+)\s?-\s?(\d+)', tree.value).groups()
+            grey_min, grey_max = RGB_values[0], RGB_values[1]
+            return f"""(exists px:Pixel . val({grey_min} <= px && px <= {grey_max}) && <report(px)>true)\n"""
+        else:
+            RGB_values = re.search('(\d+)\s?-\s?(\d+)\s?,\s?(\d+)\s?-\s?(\d+)\s?,\s?(\d+)\s?-\s?(\d+)', tree.value).groups()
+            red_min, red_max = RGB_values[0], RGB_values[1]
+            green_min, green_max = RGB_values[2], RGB_values[3]
+            blue_min, blue_max = RGB_values[4], RGB_values[5]
+            return f"""(exists px:Pixel . val(
                     {red_min} <= red(px) && red(px) <= {red_max} && 
                     {green_min} <= green(px) && green(px) <= {green_max} &&
                     {blue_min} <= blue(px) && blue(px) <= {blue_max}) && <report(px)>true)\n"""
-        else:
-            return f"""'<{tree.value}>true'"""
+    else:
+        return f"""'<{tree.value}>true'"""
+
+# Largest amount of nested N^k operators in the (sub)formula
+def bounded_near_depth(tree):
+    depth = max([bounded_near_depth(child) for child in (tree.left, tree.right) if child is not None], default=0)
+    return depth + 1 if tree.value != 'N' and near_bound(tree.value) is not None else depth
+
+# Creates a modal-mu formula from the AST of the SLCS formula
+def modal_mu_from_tree(tree):
+    if PROPOSITIONS and proposition_key(tree) in PROPOSITIONS: # precomputed, reported as action by the model
+        return f"""(<ap_{PROPOSITIONS[proposition_key(tree)]}>true)\n"""
+    if tree.is_leaf(): # Handle atomic propositions
+        return atomic_formula(tree)
     # set subformula variables
     phi_1 = modal_mu_from_tree(tree.left) if tree.left is not None else None
     phi_2 = modal_mu_from_tree(tree.right) if tree.right is not None else None
@@ -152,6 +297,11 @@ def modal_mu_from_tree(tree):
         return f'(!(!({phi_1}) && !({phi_2})))'
     elif tree.value == 'N':
         return f'(<R>{phi_2})\n'
+    elif near_bound(tree.value) is not None: # N^k, a single fixpoint counting the R steps
+        Z = f'Z{bounded_near_depth(tree.right)}' # unique name within nested N^k
+        return f'(mu {Z}(n{Z}: Nat = 0).({phi_2} || (val(n{Z} < {near_bound(tree.value)}) && <R>{Z}(n{Z} + 1))))\n'
+    elif distance_bound(tree.value) is not None:
+        raise SyntaxError(f'Operator \'{tree.value}\' requires precomputed atomic propositions (--atoms)')
     elif tree.value == 'S':
         return f'(({phi_1}) && !mu X.(!({phi_1} || {phi_2}) || ({phi_1} && <R>X)))\n'
     elif tree.value == None: # None-values only occur under excessive bracket usage
@@ -159,26 +309,104 @@ def modal_mu_from_tree(tree):
     else:
         return
 
-def write_to_mcf(result, basefile):
-    if MCRL2:
+# Creates a modal-mu formula from the (optimized) DAG of the SLCS formula in which every
+# subformula occurs only once, as case k of a single data-parameterized fixpoint F(k:Nat).
+# Negations are pushed inwards to the atomic propositions, so F only occurs positively and the
+# surround operator becomes a greatest fixpoint:
+#   phi_1 S phi_2 = phi_1 && nu Y.((phi_1 || phi_2) && (!phi_1 || [R]Y))
+def modal_mu_shared(tree):
+    bodies = [] # body of case k of F
+    cases = {} # maps (canonical form, negated) to k
+
+    def case(tree, negated):
+        while tree.value == None or (tree.value == '!' and not tree.is_leaf()): # brackets and negations
+            if tree.value == '!':
+                negated = not negated
+                tree = tree.right
+            else:
+                tree = tree.left
+        key = (canonical_form(tree), negated)
+        if key in cases:
+            return f'F({cases[key]})'
+
+        if PROPOSITIONS and proposition_key(tree) in PROPOSITIONS:
+            action = f'ap_{PROPOSITIONS[proposition_key(tree)]}'
+            body = f'[{action}]false' if negated else f'<{action}>true'
+        elif tree.is_leaf():
+            body = atomic_formula(tree).strip()
+            body = f'!{body}' if negated else body
+        elif tree.value in ('&&', '||'):
+            operator = ('&&' if tree.value == '||' else '||') if negated else tree.value
+            body = f'({case(tree.left, negated)} {operator} {case(tree.right, negated)})'
+        elif tree.value == 'N':
+            body = f'[R]{case(tree.right, True)}' if negated else f'<R>{case(tree.right, False)}'
+        elif near_bound(tree.value) is not None: # N^k counts its R steps, the negation bounds the paths by k steps
+            k, phi = near_bound(tree.value), case(tree.right, negated)
+            Z = f'Z{len(bodies)}' # unique name for the nested fixpoint variable
+            if negated:
+                body = f'nu {Z}(n{Z}: Nat = 0).({phi} && (val(n{Z} >= {k}) || [R]{Z}(n{Z} + 1)))'
+            else:
+                body = f'mu {Z}(n{Z}: Nat = 0).({phi} || (val(n{Z} < {k}) && <R>{Z}(n{Z} + 1)))'
+        elif distance_bound(tree.value) is not None:
+            raise SyntaxError(f'Operator \'{tree.value}\' requires precomputed atomic propositions (--atoms)')
+        elif tree.value == 'S':
+            phi_1, not_phi_1 = case(tree.left, False), case(tree.left, True)
+            phi_2, not_phi_2 = case(tree.right, False), case(tree.right, True)
+            Y = f'Y{len(bodies)}' # unique name for the nested fixpoint variable
+            if negated:
+                body = f'({not_phi_1} || mu {Y}.(({not_phi_1} && {not_phi_2}) || ({phi_1} && <R>{Y})))'
+            else:
+                body = f'({phi_1} && nu {Y}.(({phi_1} || {phi_2}) && ({not_phi_1} || [R]{Y})))'
+        else:
+            raise SyntaxError(f'Operator \'{tree.value}\' is not supported')
+        cases[key] = len(bodies)
+        bodies.append(body)
+        return f'F({cases[key]})'
+
+    root = case(tree, False)[2:-1]
+    conjuncts = '\n && '.join(f'(val(k == {k}) => {body})' for k, body in enumerate(bodies))
+    return f'(nu F(k: Nat = {root}).(\n    {conjuncts}\n))\n'
+
+# if roi is set, the formula is only evaluated in the states reached by a start action, see image2mcrl2.write_roi_process
+def write_to_mcf(result, basefile, roi = False):
+    if MCRL2 and roi:
+        result = '[start] nu X.' + result # pixels of the region of interest instead of all reachable states
+    elif MCRL2:
         result = '[true*] nu X.' + result # add necessary mcrl2 prefix
     mcffile = basefile + '.mcf'
     with open(mcffile, "w") as file:
         file.write(result)
     return mcffile
 
-def translate_SLCS_formula(SLCSformula, greyscale, mcrl2):
+# Sets the globals for the given options and builds the AST of the SLCS formula
+def parse_SLCS_formula(SLCSformula, greyscale, mcrl2):
     if greyscale: # set optimization global
         global GREYSCALE
         GREYSCALE = True
     if mcrl2: # set mcrl2 global
         global MCRL2
         MCRL2 = True    
-    SLCS_Ast = build_SLCS_AST(SLCSformula) # build AST from formula
-    result = modal_mu_from_tree(SLCS_Ast) # generate modalmu calculus formula from AST
+    return build_SLCS_AST(SLCSformula) # build AST from formula
 
-    basefile = SLCSformula[:-5] # strip .slcs from file
-    mcffile = write_to_mcf(result, basefile)  # write result to .mcf file
+# propositions is an optional list of precomputed subformulae, the i-th becomes <ap_i>true
+# optimize emits every shared subformula once, see optimize_tree and modal_mu_shared
+# basefile optionally sets the path of the .mcf file without extension, by default the .slcs path is used
+# roi evaluates the formula only in the pixels of a region of interest, see write_to_mcf
+def translate_SLCS_formula(SLCSformula, greyscale, mcrl2, propositions = None, optimize = False, basefile = None, roi = False):
+    global PROPOSITIONS
+    PROPOSITIONS = {proposition_key(tree): index for index, tree in enumerate(propositions or [])}
+    if basefile is None:
+        basefile = SLCSformula[:-5] # strip .slcs from file
+    with stage_profiler.stage('formula translation', basefile + '.mcf'):
+        SLCS_Ast = parse_SLCS_formula(SLCSformula, greyscale, mcrl2) # build AST from formula
+        result = modal_mu_from_tree(SLCS_Ast) # generate modalmu calculus formula from AST
+        if optimize:
+            shared = {}
+            optimized = optimize_tree(SLCS_Ast, shared)
+            optimized_result = modal_mu_shared(optimized)
+            print(f'[slcs2modalmu]    formula size: {count_nodes(SLCS_Ast)} nodes, {len(result)} characters -> {len(set(map(id, shared.values())))} shared nodes, {len(optimized_result)} characters')
+            result = optimized_result
+        mcffile = write_to_mcf(result, basefile, roi)  # write result to .mcf file
 
     print(f'[slcs2modalmu]    successfully saved modal mu-formula to {mcffile}')
 
@@ -195,7 +423,9 @@ if __name__ == '__main__':
     parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type = lambda f: check_extension('.slcs', f))
     parser.add_argument("--mcrl2", help = "output atomic propositions in mCRL2 format", action = "store_true")
     parser.add_argument("--greyscale", help = "optimization for monochromatic images in mCRL2 - use suitable SLCS formula and mcrl2 argument", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    parser.add_argument("--roi", help = "evaluate the formula only in the states reached by a start action, for a specification with a region of interest", action = "store_true")
 
     args = parser.parse_args()
 
-    mcffile = translate_SLCS_formula(args.slcsformula, args.greyscale, args.mcrl2)
\ No newline at end of file
+    mcffile = translate_SLCS_formula(args.slcsformula, args.greyscale, args.mcrl2, optimize = args.optimize, roi = args.roi)
\ No newline at end of file
@@ -0,0 +1,65 @@
+'''
+stack_image
+Verifies a SLCS formula on a stack of images (e.g. the slices of an MRI volume) at once
+
+All images are held by a single mCRL2 specification with the image index as extra
+process parameter (see image2mcrl2), so mcrl22lps, lps2pbes and pbessolve only run
+once per stack instead of once per image. The solution is split into the pixel
+coordinates of every image, and one marked image is saved per image.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import numpy as np
+
+# other scripts
+import batch_image
+import image2mcrl2
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+def do_stack(imagefiles, SLCSformula, greyscale, palette = False, encoding = 'list', atoms = False, optimize = False, mark_colour = batch_image.MARK_COLOUR):
+    if atoms: # masks of shape (images, height, width)
+        SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+        predicates = slcs2modalmu.collect_atomic_predicates(SLCS_Ast)
+        image_masks = [native_image.proposition_masks(imagefile, predicates, greyscale) for imagefile in imagefiles]
+        propositions = [np.stack(masks) for masks in zip(*image_masks)]
+    else:
+        predicates, propositions = None, None
+    mcrl2file = image2mcrl2.create_mcrl2_specification(imagefiles, greyscale, palette, encoding, propositions)
+    mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates, optimize)
+    true_coords = pbessolve_image.do_pbessolve(mcrl2file, mcffile)
+    image_coords = pbessolve_image.split_stack_solutions(true_coords, len(imagefiles))
+
+    for imagefile, coords in zip(imagefiles, image_coords):
+        marked_imagefile = batch_image.save_marked_image(imagefile, SLCSformula, coords, mark_colour)
+        print(f'[stack_image]    {len(coords)} pixels of {imagefile} satisfy the formula, saved marked image to {marked_imagefile}')
+
+    return image_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("images", help = "the images of the stack, of equal dimensions, allowed formats: png, jpg, jpeg", type=check_image_extension, nargs = '+')
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--markcolour", help = "set a custom mark colour with three integers representing its RGB value", nargs=3, type=int, default = batch_image.MARK_COLOUR)
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the stack", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the stack in the mcrl2 specification, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python and report them as actions ap_i in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    args = parser.parse_args()
+
+    image_coords = do_stack(args.images, args.slcsformula, args.greyscale, args.palette, args.encoding, args.atoms, args.optimize, tuple(args.markcolour))
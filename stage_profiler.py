@@ -0,0 +1,101 @@
+'''
+stage_profiler
+Records resource usage per stage of the pipeline, e.g. spec generation or pbessolve
+
+For every stage, the wall time and CPU time of this process are recorded, as well as the
+CPU time and peak resident set size of the mCRL2 tools it executes (via os.wait4, only
+available on Unix), the size of the file the stage writes and stage specific counters
+such as the amount of BES equations. If tracemalloc is tracing, the peak of the memory
+allocated by this process during a stage is recorded as well. Profiling is off unless a
+Stage_Profiler is set as ACTIVE, otherwise stage() and run() are no-ops apart from
+executing the tool.
+'''
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+
+ACTIVE = None # profiler recording the stages, None if profiling is off
+FIELDS = ['stage', 'wall_time', 'cpu_time', 'child_cpu_time', 'child_peak_rss_kb', 'peak_traced_kb', 'file_size'] # leading columns of the report
+
+class Stage_Profiler:
+    def __init__(self) -> None:
+        self.stages = [] # one record per stage, in order of completion
+        self.current = None # record of the running stage
+
+    # adds the resource usage of a finished child process to the running stage
+    def record_child(self, usage):
+        if self.current is None:
+            return
+        peak_rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss # bytes on macOS, KB elsewhere
+        self.current['child_cpu_time'] = self.current.get('child_cpu_time', 0) + usage.ru_utime + usage.ru_stime
+        self.current['child_peak_rss_kb'] = max(self.current.get('child_peak_rss_kb', 0), peak_rss)
+
+    def count(self, name, value):
+        if self.current is not None:
+            self.current[name] = self.current.get(name, 0) + value
+
+    # writes the report as [basefile]_profile.json and [basefile]_profile.csv
+    def save(self, basefile):
+        jsonfile, csvfile = basefile + '_profile.json', basefile + '_profile.csv'
+        with open(jsonfile, 'w') as file:
+            json.dump(self.stages, file, indent=4)
+        fields = FIELDS + sorted({key for record in self.stages for key in record} - set(FIELDS))
+        with open(csvfile, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fields)
+            writer.writeheader()
+            writer.writerows(self.stages)
+        return jsonfile, csvfile
+
+# Records a stage of the pipeline with the active profiler, outputfile is the file written by the stage
+@contextmanager
+def stage(name, outputfile = None):
+    profiler = ACTIVE
+    if profiler is None:
+        yield
+        return
+    record = {'stage': name}
+    outer, profiler.current = profiler.current, record
+    if tracemalloc.is_tracing(): # the peak of the outer stage so far is kept before the peak is reset
+        if outer is not None:
+            record_peak(outer)
+        tracemalloc.reset_peak()
+    start_wall, start_cpu = timeit.default_timer(), time.process_time()
+    try:
+        yield
+    finally:
+        record['wall_time'] = timeit.default_timer() - start_wall
+        record['cpu_time'] = time.process_time() - start_cpu
+        if tracemalloc.is_tracing():
+            record_peak(record)
+        if outputfile is not None and os.path.exists(outputfile):
+            record['file_size'] = os.path.getsize(outputfile)
+        profiler.current = outer
+        profiler.stages.append(record)
+
+# Adds the traced peak memory since the last reset to a record
+def record_peak(record):
+    peak = tracemalloc.get_traced_memory()[1] // 1024
+    record['peak_traced_kb'] = max(record.get('peak_traced_kb', 0), peak)
+
+def count(name, value):
+    if ACTIVE is not None:
+        ACTIVE.count(name, value)
+
+# Waits for a child process, recording its resource usage with the active profiler
+def wait(process):
+    if ACTIVE is not None and hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status) # the process is reaped, Popen must not wait for it again
+        ACTIVE.record_child(usage)
+    return process.wait()
+
+# Executes a tool like subprocess.run, recording its resource usage with the active profiler
+def run(arguments, **kwargs):
+    process = subprocess.Popen(arguments, **kwargs)
+    return wait(process)
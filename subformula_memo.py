@@ -0,0 +1,173 @@
+'''
+subformula_memo
+Memoizes the satisfaction masks of subformulae across formulae and runs
+
+Formula libraries reuse the same building blocks, e.g. y S p occurs within
+b S (y S p || b). The memo stores the mask of every solved (sub)formula, keyed by its
+canonical form (see slcs2modalmu.canonical_form, so operands of && and || may be
+swapped) and the hash of the image. When a formula is checked, the largest memoized
+subformulae are substituted as precomputed propositions ap_i in the specification, like
+--atoms does for atomic propositions, so only the novel parts of the formula are
+translated and solved. A formula that is memoized as a whole is not solved at all.
+The mCRL2 engines store the mask of the whole formula, the native engine the masks of
+all its subformulae. The least recently used masks are evicted once the memo exceeds
+its size bound.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import os
+
+# other scripts
+import artifact_cache
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+MEMO_DIR = os.path.join(artifact_cache.CACHE_DIR, 'subformulae') # default memo location
+MAX_MEMO_SIZE = 256 # default size bound of the memo in MB
+
+# Artifact cache of subformula masks, the hashes of the images are computed once per run
+class Subformula_Memo(artifact_cache.Artifact_Cache):
+    def __init__(self, directory = MEMO_DIR, max_size = MAX_MEMO_SIZE) -> None:
+        super().__init__(directory, max_size)
+        self.image_keys = {} # maps image files to the hash of their pixels
+
+    def image_key(self, imagefile):
+        if imagefile not in self.image_keys:
+            self.image_keys[imagefile] = artifact_cache.hash_image(imagefile)
+        return self.image_keys[imagefile]
+
+    def key(self, imagefile, greyscale, tree):
+        return artifact_cache.stage_key('subformula', self.image_key(imagefile), greyscale, slcs2modalmu.proposition_key(tree))
+
+# Collects the memoized subformulae of the AST and the atomic (and distance) predicates of its novel parts
+# found maps the keys of the collected (sub)formulae to their tree and mask, in order of appearance
+def collect_memoized(tree, memo, imagefile, greyscale, pixels, found):
+    key = slcs2modalmu.proposition_key(tree)
+    if key in found:
+        return
+    if tree.value == None and not tree.is_leaf(): # brackets
+        collect_memoized(tree.left, memo, imagefile, greyscale, pixels, found)
+        return
+    if tree.is_leaf(): # cheaper to compute than to load
+        found[key] = (tree, native_image.evaluate_tree(tree, pixels))
+        return
+    mask = memo.fetch_mask(memo.key(imagefile, greyscale, tree))
+    if mask is not None:
+        found[key] = (tree, mask)
+    elif slcs2modalmu.distance_bound(tree.value) is not None: # cannot be expressed in the model, see native_image.distance_within
+        mask = native_image.evaluate_tree(tree, pixels)
+        memo.store_mask(memo.key(imagefile, greyscale, tree), mask)
+        found[key] = (tree, mask)
+    else:
+        for child in (tree.left, tree.right):
+            if child is not None:
+                collect_memoized(child, memo, imagefile, greyscale, pixels, found)
+
+# Replaces precompute_atomic_predicates of native_image for the mCRL2 engines
+# returns the precomputed (sub)formulae, their masks, and the mask of the whole formula if it is memoized (else None)
+def memoized_predicates(memo, imagefile, SLCSformula, greyscale):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+    found = {}
+    collect_memoized(SLCS_Ast, memo, imagefile, greyscale, native_image.load_pixels(imagefile, greyscale), found)
+    reused = [slcs2modalmu.canonical_form(tree) for tree, _ in found.values() if not tree.is_leaf()]
+    print(f'[subformula_memo]    reused {len(reused)} memoized subformulae of {SLCSformula}: {", ".join(reused)}')
+    predicates = [tree for tree, _ in found.values()]
+    propositions = [mask for _, mask in found.values()]
+    root = found.get(slcs2modalmu.proposition_key(SLCS_Ast))
+    return predicates, propositions, root[1] if root is not None else None
+
+# Stores the mask of the whole formula, e.g. once it is solved by an mCRL2 engine
+def store_formula(memo, imagefile, SLCSformula, greyscale, mask):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+    if not SLCS_Ast.is_leaf():
+        memo.store_mask(memo.key(imagefile, greyscale, SLCS_Ast), mask)
+
+# Evaluates the formula with the native engine, reusing memoized subformulae and storing all others
+def do_memoized_native(imagefile, SLCSformula, greyscale, memo, optimize = False):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True)
+    if optimize:
+        SLCS_Ast = slcs2modalmu.optimize_tree(SLCS_Ast)
+    pixels = native_image.load_pixels(imagefile, greyscale)
+    found = {}
+    collect_memoized(SLCS_Ast, memo, imagefile, greyscale, pixels, found)
+    masks = {}
+    mask = native_image.evaluate_tree(SLCS_Ast, pixels, masks, {key: mask for key, (_, mask) in found.items()})
+
+    stored = 0
+    pending = [SLCS_Ast]
+    while pending: # store the subformulae evaluated in this run, memoized ones are not descended into
+        tree = pending.pop()
+        if tree.is_leaf() or id(tree) not in masks:
+            continue
+        if slcs2modalmu.proposition_key(tree) in found:
+            continue
+        if tree.value != None: # brackets share the mask of their subformula
+            memo.store_mask(memo.key(imagefile, greyscale, tree), masks[id(tree)])
+            stored += 1
+        pending.extend(child for child in (tree.left, tree.right) if child is not None)
+    true_coords = native_image.mask_to_coords(mask)
+
+    print(f'[subformula_memo]    reused {sum(not tree.is_leaf() for tree, _ in found.values())} and stored {stored} subformulae of {SLCSformula}')
+    print(f'[subformula_memo]    pixel coordinates that satisfy {SLCSformula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+# Verifies the formula with pbessolve, substituting memoized subformulae as precomputed propositions
+# the formula is not optimized, as optimize_tree would flatten the memoized subformulae that are substituted
+# solve optionally replaces pbessolve, e.g. by another engine of verify_image; it is called with the
+# precomputed (sub)formulae and their masks and returns the pixel coordinates that satisfy the formula
+def do_memoized_pbessolve(imagefile, SLCSformula, greyscale, memo, palette = False, encoding = 'list', solve = None):
+    predicates, propositions, mask = memoized_predicates(memo, imagefile, SLCSformula, greyscale)
+    if mask is not None:
+        true_coords = native_image.mask_to_coords(mask)
+        print(f'[subformula_memo]    restored {SLCSformula} from memo')
+    else:
+        if solve is not None:
+            true_coords = solve(predicates, propositions)
+        else:
+            mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale, palette, encoding, propositions)
+            mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates)
+            true_coords = pbessolve_image.do_pbessolve(mcrl2file, mcffile)
+        store_formula(memo, imagefile, SLCSformula, greyscale, native_image.coords_to_mask(true_coords, propositions[0].shape))
+
+    print(f'[subformula_memo]    pixel coordinates that satisfy {SLCSformula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformula", help = "the spatial logic formulae, in .slcs format, checked in order", type=lambda f: check_extension('.slcs', f), nargs = '+')
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--engine", help = "verify with the mCRL2 toolset or with the native (NumPy) engine", choices = ['mcrl2', 'native'], default = 'mcrl2')
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the image", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the image, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before evaluating it, native engine only", action = "store_true")
+    parser.add_argument("--memodir", help = "directory of the subformula memo", default = MEMO_DIR)
+    parser.add_argument("--memosize", help = "size bound of the subformula memo in MB", type = int, default = MAX_MEMO_SIZE)
+    args = parser.parse_args()
+    if args.optimize and args.engine != 'native':
+        parser.error('--optimize requires --engine native')
+
+    memo = Subformula_Memo(args.memodir, args.memosize)
+    for slcsformula in args.slcsformula:
+        if args.engine == 'native':
+            do_memoized_native(args.image, slcsformula, args.greyscale, memo, args.optimize)
+        else:
+            do_memoized_pbessolve(args.image, slcsformula, args.greyscale, memo, args.palette, args.encoding)
@@ -0,0 +1,198 @@
+'''
+tiled_image
+Verifies a SLCS formula on a large image by splitting it into tiles that are checked in parallel
+
+The atomic propositions of the formula are precomputed on the whole image (see
+image2mcrl2 and the --atoms option), so every tile is a small model reporting
+actions ap_i. A tile is extended by a halo of as many pixels as the nesting depth
+of N in the formula, which makes the result in its core identical to the result
+of a whole-image run.
+The surround operator depends on reachability across tile borders, so every S
+subformula is resolved first, innermost first: the masks of its operands are
+computed tile by tile, the components of phi_1 are labelled per tile and the
+labels of components that touch across tile borders are merged with a union-find.
+The resolved mask is then used as a precomputed proposition by the enclosing formula.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# other scripts
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import pgsolve_image
+import slcs2modalmu
+
+TILE_SIZE = 64 # default width and height of a tile in pixels
+ENGINES = ['mcrl2', 'pgsolver', 'native'] # engines verifying a single tile
+
+# Keys of the precomputed propositions the formula consists of
+def used_propositions(tree, propositions, used = None):
+    if used is None:
+        used = []
+    key = slcs2modalmu.proposition_key(tree)
+    if key in propositions:
+        if key not in used:
+            used.append(key)
+        return used
+    for child in (tree.left, tree.right):
+        if child is not None:
+            used_propositions(child, propositions, used)
+    return used
+
+# Splits a grid of the given (height, width) shape into tiles of at most size x size pixels
+# yields the core of every tile and the core extended by the halo, as (y0, y1, x0, x1) boxes
+def split_tiles(shape, size, halo):
+    height, width = shape
+    for y0 in range(0, height, size):
+        for x0 in range(0, width, size):
+            y1, x1 = min(y0 + size, height), min(x0 + size, width)
+            yield (y0, y1, x0, x1), (max(y0 - halo, 0), min(y1 + halo, height), max(x0 - halo, 0), min(x1 + halo, width))
+
+# Core box relative to the box extended by the halo
+def relative_box(core, box):
+    return (core[0] - box[0], core[1] - box[0], core[2] - box[2], core[3] - box[2])
+
+# Computes the satisfaction mask of the formula on a single tile, given the masks of its propositions
+# on the tile and its halo, and returns the mask of the core of the tile
+def verify_tile(tree, keys, masks, core, engine, encoding):
+    if engine == 'native':
+        mask = native_image.evaluate_tree(tree, None, propositions = dict(zip(keys, masks)))
+    else:
+        with tempfile.TemporaryDirectory() as directory: # every tile gets its own files
+            basefile = os.path.join(directory, 'tile')
+            specification = basefile + '.mcrl2'
+            image2mcrl2.ENCODING = encoding
+            with open(specification, 'w') as file:
+                image2mcrl2.write_mCRL2_spec(None, file, masks)
+            slcs2modalmu.MCRL2 = True
+            slcs2modalmu.PROPOSITIONS = {key: index for index, key in enumerate(keys)}
+            formula = slcs2modalmu.write_to_mcf(slcs2modalmu.modal_mu_from_tree(tree), basefile)
+            if engine == 'pgsolver':
+                true_coords = pgsolve_image.do_pgsolve(specification, formula)
+            else:
+                true_coords = pbessolve_image.do_pbessolve(specification, formula)
+            mask = native_image.coords_to_mask(true_coords, masks[0].shape)
+    y0, y1, x0, x1 = core
+    return mask[y0:y1, x0:x1]
+
+# Computes the satisfaction mask of a formula without unresolved S subformulae, tile by tile
+def evaluate_tiled(tree, propositions, shape, executor, size, engine, encoding):
+    key = slcs2modalmu.proposition_key(tree)
+    if key in propositions:
+        return propositions[key]
+    keys = used_propositions(tree, propositions)
+    halo = slcs2modalmu.near_depth(tree, propositions) # resolved S subformulae are local
+    print(f'[tiled_image]    verifying {slcs2modalmu.canonical_form(tree)} on tiles of {size}x{size} pixels with a halo of {halo} pixels')
+    futures = []
+    for core, box in split_tiles(shape, size, halo):
+        y0, y1, x0, x1 = box
+        masks = [propositions[key][y0:y1, x0:x1] for key in keys]
+        futures.append((core, executor.submit(verify_tile, tree, keys, masks, relative_box(core, box), engine, encoding)))
+    mask = np.zeros(shape, dtype=bool)
+    for (y0, y1, x0, x1), future in futures:
+        mask[y0:y1, x0:x1] = future.result()
+    return mask
+
+# Labels the components of phi_1 within the core of a tile and marks the phi_1 pixels of the core
+# that are adjacent to a pixel satisfying neither phi_1 nor phi_2, given the masks on the tile and a halo of 1
+# labels are flat indices into the whole image of the given width, so labels of different tiles never collide
+def surround_tile(phi_1, phi_2, core, box, width, size):
+    escape = native_image.near(~(phi_1 | phi_2)) & phi_1
+    y0, y1, x0, x1 = relative_box(core, box)
+    phi_1, escape = phi_1[y0:y1, x0:x1], escape[y0:y1, x0:x1]
+    labels = native_image.label_components(phi_1)
+    ys, xs = np.divmod(labels, x1 - x0)
+    labels = np.where(phi_1, (ys + core[0]) * width + xs + core[2], size)
+    return labels, escape
+
+# Computes phi_1 S phi_2 tile by tile, reconciling the components of phi_1 across tile borders
+def surround_tiled(phi_1, phi_2, executor, size):
+    height, width = phi_1.shape
+    futures = []
+    for core, box in split_tiles(phi_1.shape, size, 1):
+        y0, y1, x0, x1 = box
+        futures.append((core, executor.submit(surround_tile, phi_1[y0:y1, x0:x1], phi_2[y0:y1, x0:x1], core, box, width, phi_1.size)))
+    labels = np.full(phi_1.shape, phi_1.size)
+    escape = np.zeros(phi_1.shape, dtype=bool)
+    for (y0, y1, x0, x1), future in futures:
+        labels[y0:y1, x0:x1], escape[y0:y1, x0:x1] = future.result()
+
+    # merge components of neighbouring tiles that touch across the border
+    sources, targets = [], []
+    for x in range(size, width, size):
+        both = phi_1[:, x - 1] & phi_1[:, x]
+        sources.append(labels[:, x - 1][both])
+        targets.append(labels[:, x][both])
+    for y in range(size, height, size):
+        both = phi_1[y - 1, :] & phi_1[y, :]
+        sources.append(labels[y - 1, :][both])
+        targets.append(labels[y, :][both])
+    if sources:
+        parent = native_image.union_find(phi_1.size + 1, np.concatenate(sources), np.concatenate(targets))
+        labels = parent[labels]
+    escaped = np.isin(labels, np.unique(labels[escape]))
+    return phi_1 & ~escaped
+
+# Resolves the S subformulae of the formula innermost first, adding their masks to the propositions
+def resolve_surrounds(tree, propositions, shape, executor, size, engine, encoding):
+    key = slcs2modalmu.proposition_key(tree)
+    if key in propositions:
+        return
+    for child in (tree.left, tree.right):
+        if child is not None:
+            resolve_surrounds(child, propositions, shape, executor, size, engine, encoding)
+    if tree.value == 'S':
+        phi_1 = evaluate_tiled(tree.left, propositions, shape, executor, size, engine, encoding)
+        phi_2 = evaluate_tiled(tree.right, propositions, shape, executor, size, engine, encoding)
+        propositions[key] = surround_tiled(phi_1, phi_2, executor, size)
+
+def do_tiled(imagefile, SLCSformula, greyscale, size = TILE_SIZE, workers = None, engine = 'mcrl2', encoding = 'list', optimize = False):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True) # atomic propositions in mcrl2 format
+    if optimize:
+        SLCS_Ast = slcs2modalmu.optimize_tree(SLCS_Ast)
+    pixels = native_image.load_pixels(imagefile, greyscale)
+    shape = pixels.shape[:2]
+    propositions = {slcs2modalmu.proposition_key(predicate): native_image.evaluate_tree(predicate, pixels)
+                    for predicate in slcs2modalmu.collect_atomic_predicates(SLCS_Ast)}
+
+    with ProcessPoolExecutor(workers) as executor:
+        resolve_surrounds(SLCS_Ast, propositions, shape, executor, size, engine, encoding)
+        mask = evaluate_tiled(SLCS_Ast, propositions, shape, executor, size, engine, encoding)
+    true_coords = native_image.mask_to_coords(mask)
+
+    print(f'[tiled_image]    pixel coordinates that satisfy {SLCSformula}: {image_output.describe_coords(true_coords)}')
+
+    return true_coords
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_image_extension(file):
+    extension = file.rsplit('.', 1)[1]
+    if extension not in ('png', 'jpg', 'jpeg'):
+         raise argparse.ArgumentTypeError('wrong image format, allowed formats: png, jpg, jpeg')
+    return file
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", help = "the image to be checked, allowed formats: png, jpg, jpeg", type=check_image_extension)
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--tilesize", help = "width and height of a tile in pixels", type = int, default = TILE_SIZE)
+    parser.add_argument("--workers", help = "amount of tiles verified in parallel, defaults to the amount of processors", type = int)
+    parser.add_argument("--engine", help = "engine verifying a single tile", choices = ENGINES, default = 'mcrl2')
+    parser.add_argument("--encoding", help = "data structure holding a tile in the mcrl2 specification, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before verifying it", action = "store_true")
+    args = parser.parse_args()
+
+    true_coords = do_tiled(args.image, args.slcsformula, args.greyscale, args.tilesize, args.workers, args.engine, args.encoding, args.optimize)
@@ -7,12 +7,43 @@ For more information regarding the structure of SLCS formulae, see the documenta
 '''
 
 import argparse
+import functools
+import os
 from PIL import Image
 import timeit
 # other scripts
+import artifact_cache
 import image2mcrl2
+import image_output
+import native_image
 import pbessolve_image
+import pgsolve_image
+import portfolio_image
+import quotient_image
+import roi_image
 import slcs2modalmu
+import stage_profiler
+import subformula_memo
+import tiled_image
+
+# Verifies the formula with the mCRL2 toolset, pgsolver or a portfolio, see the arguments of the engines
+# predicates and propositions are the precomputed (sub)formulae and their masks, or None
+def solve_mcrl2(imagefile, slcsfile, greyscale, args, roi, predicates, propositions):
+    with pbessolve_image.Toolchain_Run() as run: # all files are written to a scratch directory of this run only, so concurrent runs do not clobber them
+        mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale, args.palette, args.encoding, propositions, roi, os.path.join(run.directory, os.path.basename(imagefile).rsplit('.', 1)[0]))
+        if args.portfolio is None: # mcrl22lps runs while the formula is translated
+            run.linearise(mcrl2file)
+        mcffile = slcs2modalmu.translate_SLCS_formula(slcsfile, greyscale, True, predicates, args.optimize, os.path.join(run.directory, os.path.basename(slcsfile)[:-5]), roi is not None) # Additional boolean to ensure the output is recognizable by mcrl2
+        if args.engine == 'pgsolver':
+            true_coords = pgsolve_image.do_pgsolve(mcrl2file, mcffile, run)
+        elif args.portfolio is not None:
+            SLCS_Ast = slcs2modalmu.parse_SLCS_formula(slcsfile, greyscale, True)
+            true_coords = portfolio_image.do_portfolio(mcrl2file, mcffile, SLCS_Ast, args.portfolio or portfolio_image.PORTFOLIO, args.timelimit, args.memorylimit, run = run)
+        else:
+            true_coords = pbessolve_image.do_pbessolve(mcrl2file, mcffile, run)
+    if roi is not None: # the start state is not part of the image
+        true_coords = roi_image.restrict_coords(true_coords, roi)
+    return true_coords
 
 def check_extension(extension, file): 
     if not file.endswith(extension):
@@ -32,7 +63,36 @@ if __name__ == '__main__':
     parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
     parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
     parser.add_argument("--markcolour", help = "set a custom mark colour with three integers representing its RGB value", nargs=3, type=int)
+    parser.add_argument("--palette", help = "emit pixels as indices into the colour palette of the image", action = "store_true")
+    parser.add_argument("--encoding", help = "data structure holding the image in the mcrl2 specification, see image2mcrl2", choices = image2mcrl2.ENCODINGS, default = 'list')
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python and report them as actions ap_i in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    parser.add_argument("--engine", help = "verify with the mCRL2 toolset, with the mCRL2 toolset and the Python parity game solver, or with the native (NumPy) engine", choices = ['mcrl2', 'pgsolver', 'native'], default = 'mcrl2')
+    parser.add_argument("--cache", help = "reuse the .mcrl2, .lps, .pbes and results of unchanged inputs from the artifact cache", action = "store_true")
+    parser.add_argument("--cachedir", help = "directory of the artifact cache", default = artifact_cache.CACHE_DIR)
+    parser.add_argument("--cachesize", help = "size bound of the artifact cache in MB", type = int, default = artifact_cache.MAX_CACHE_SIZE)
+    parser.add_argument("--memo", help = "reuse the masks of subformulae solved in earlier runs as precomputed propositions, see subformula_memo", action = "store_true")
+    parser.add_argument("--memodir", help = "directory of the subformula memo", default = subformula_memo.MEMO_DIR)
+    parser.add_argument("--memosize", help = "size bound of the subformula memo in MB", type = int, default = subformula_memo.MAX_MEMO_SIZE)
+    parser.add_argument("--quotient", help = "verify the formula on a quotient of the image, in which connected pixels that cannot be distinguished by the formula form one state, see quotient_image", action = "store_true")
+    parser.add_argument("--tiles", help = "split the image into tiles of TILES x TILES pixels that are verified in parallel, see tiled_image", type = int)
+    parser.add_argument("--workers", help = "amount of tiles verified in parallel, defaults to the amount of processors", type = int)
+    parser.add_argument("--portfolio", help = "race pbessolve configurations and take the first result, optionally naming the configurations, see portfolio_image", nargs = '*', choices = list(portfolio_image.CONFIGURATIONS))
+    parser.add_argument("--timelimit", help = "seconds after which all configurations of the portfolio are killed", type = float)
+    parser.add_argument("--memorylimit", help = "address space of every tool of the portfolio in MB (Unix only)", type = int)
+    parser.add_argument("--roi", help = "only verify the pixels of a region of interest, given as box x0,y0,x1,y1 or as mask (png, jpg, jpeg, npy, npz), see roi_image", type = roi_image.parse_roi)
+    parser.add_argument("--nocoords", help = "print only the amount of satisfying pixels instead of their coordinates", action = "store_true")
+    parser.add_argument("--export", help = "also save the satisfying pixels in compact formats, see image_output", nargs = '+', choices = image_output.EXPORT_FORMATS, default = [])
+    parser.add_argument("--profile", help = "record time, memory and output size of every stage, saved as [PATH_IMG]_[FORMULA]_profile.json and .csv", action = "store_true")
     args = parser.parse_args()
+    if args.roi is not None and (args.tiles is not None or args.quotient or args.cache):
+        parser.error('--roi cannot be combined with --tiles, --quotient or --cache')
+    if args.portfolio is not None and (args.engine != 'mcrl2' or args.tiles is not None or args.quotient or args.cache):
+        parser.error('--portfolio requires --engine mcrl2 and cannot be combined with --tiles, --quotient or --cache')
+    if args.memo and (args.tiles is not None or args.quotient or args.cache or args.roi is not None):
+        parser.error('--memo cannot be combined with --tiles, --quotient, --cache or --roi')
+    if args.memo and args.optimize and args.engine != 'native': # optimize_tree would flatten the memoized subformulae that are substituted
+        parser.error('--memo can only be combined with --optimize for --engine native')
     
     imagefile = args.image
     slcsfile = args.slcsformula
@@ -40,11 +100,39 @@ if __name__ == '__main__':
 
     mark_colour = (144,238,144)
 
+    if args.nocoords:
+        image_output.PRINT_COORDS = False
+    if args.profile:
+        stage_profiler.ACTIVE = stage_profiler.Stage_Profiler()
+
     start_time = timeit.default_timer() # timing purposes
 
-    mcrl2file = image2mcrl2.create_mcrl2_specification(imagefile, greyscale)
-    mcffile = slcs2modalmu.translate_SLCS_formula(slcsfile, greyscale, True) # Additional boolean to ensure the output is recognizable by mcrl2
-    true_coords = pbessolve_image.do_pbessolve(mcrl2file, mcffile)
+    memo = subformula_memo.Subformula_Memo(args.memodir, args.memosize) if args.memo else None
+    roi = None
+    if args.roi is not None:
+        with Image.open(imagefile) as im:
+            roi = roi_image.roi_mask(args.roi, (im.height, im.width))
+
+    if args.tiles is not None:
+        true_coords = tiled_image.do_tiled(imagefile, slcsfile, greyscale, args.tiles, args.workers, args.engine, args.encoding, args.optimize)
+    elif args.engine == 'native':
+        with stage_profiler.stage('native evaluation'):
+            if memo is not None:
+                true_coords = subformula_memo.do_memoized_native(imagefile, slcsfile, greyscale, memo, args.optimize)
+            else:
+                true_coords = native_image.do_native(imagefile, slcsfile, greyscale, args.optimize, roi)
+    elif args.quotient:
+        true_coords = quotient_image.do_quotient(imagefile, slcsfile, greyscale, args.optimize)
+    elif args.cache:
+        cache = artifact_cache.Artifact_Cache(args.cachedir, args.cachesize)
+        true_coords = artifact_cache.do_cached_pbessolve(imagefile, slcsfile, greyscale, cache, args.palette, args.encoding, args.atoms, args.optimize)
+    else:
+        solve = functools.partial(solve_mcrl2, imagefile, slcsfile, greyscale, args, roi)
+        if memo is not None: # memoized subformulae become precomputed propositions, like the atomic ones
+            true_coords = subformula_memo.do_memoized_pbessolve(imagefile, slcsfile, greyscale, memo, args.palette, args.encoding, solve)
+        else:
+            predicates, propositions = native_image.precompute_atomic_predicates(imagefile, slcsfile, greyscale) if args.atoms else (None, None)
+            true_coords = solve(predicates, propositions)
 
     print(f'Elapsed time: {timeit.default_timer() - start_time} seconds') # print time elapsed in seconds 
 
@@ -52,19 +140,25 @@ if __name__ == '__main__':
     if args.markcolour is not None:
         mark_colour = (args.markcolour[0], args.markcolour[1], args.markcolour[2])        
     
-    with Image.open(imagefile) as im:
-        # mark pixels which satisfy the formula
-        im = Image.open(imagefile)
-        for coord in true_coords:
-            im.putpixel(coord, mark_colour)
-
-        # prepare output file name [PATH_IMG]_[FORMULA].png, save it as PNG, and close image
-        base_imagefile = imagefile.rsplit('.', 1)[0] # only remove extention from image
-        base_slcsfile = slcsfile.rsplit('.', 1)[0]
-        if '\\' in base_slcsfile:
-            base_slcsfile = base_slcsfile.rsplit('\\', 1)[1] # extract only name from slcs file
-        marked_imagefile = f'{base_imagefile}_{base_slcsfile}.png'
-        im.save(marked_imagefile, 'PNG') 
-        im.close()
-
-    print(f'\n*** successfully saved marked image to {marked_imagefile} ***')
\ No newline at end of file
+    # prepare output file name [PATH_IMG]_[FORMULA].png
+    base_imagefile = imagefile.rsplit('.', 1)[0] # only remove extention from image
+    base_slcsfile = slcsfile.rsplit('.', 1)[0]
+    if '\\' in base_slcsfile:
+        base_slcsfile = base_slcsfile.rsplit('\\', 1)[1] # extract only name from slcs file
+    marked_imagefile = f'{base_imagefile}_{base_slcsfile}.png'
+
+    with stage_profiler.stage('image marking', marked_imagefile), Image.open(imagefile) as im:
+        # mark pixels which satisfy the formula and save it as PNG
+        mask = native_image.coords_to_mask(true_coords, (im.height, im.width))
+        image_output.mark_image(im, mask, mark_colour).save(marked_imagefile, 'PNG')
+
+    print(f'\n*** successfully saved marked image to {marked_imagefile} ***')
+
+    for format in args.export:
+        with stage_profiler.stage(f'{format} export'):
+            outputfile = image_output.save_mask(mask, f'{base_imagefile}_{base_slcsfile}', format)
+        print(f'*** saved {format} mask to {outputfile} ***')
+
+    if args.profile:
+        jsonfile, csvfile = stage_profiler.ACTIVE.save(f'{base_imagefile}_{base_slcsfile}')
+        print(f'*** saved profile to {jsonfile} and {csvfile} ***')
@@ -0,0 +1,379 @@
+'''
+verify_server
+Long-running verification service, avoiding the start-up cost of a process per check
+
+Jobs are received over a local socket (TCP on localhost or a Unix domain socket) as one
+JSON object per line, e.g.
+    {"id": 1, "image": "/path/img.png", "formula": "/path/f.slcs", "engine": "mcrl2"}
+with the optional fields greyscale, palette, encoding, atoms, optimize, markcolour,
+mark (default true), export (formats of image_output) and coords (include the satisfying
+coordinates in the result). Paths are resolved by the server, so they should be absolute.
+A result line is written back as soon as a job completes, so results of one connection
+arrive in order of completion: {"id": 1, "status": "ok", "pixels": 42, ...} or
+{"id": 1, "status": "error", "error": "..."}.
+
+Jobs wait in a bounded queue served by a fixed amount of workers. While the queue is full,
+the server stops reading from the connections, which pushes back on the clients. The mCRL2
+tools run as asyncio subprocesses and the output of pbessolve is parsed while it is read.
+The Python stages (formula translation, spec generation, marking) run on the event loop
+between two awaits, since they configure the module globals of the pipeline. The native
+engine runs in a pool of worker processes, each configuring its own globals. Translated
+formulae and the .lps of specifications are kept warm in memory, evicting the least
+recently used entries.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import timeit
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+# other scripts
+import artifact_cache
+import batch_image
+import image2mcrl2
+import image_output
+import native_image
+import pbessolve_image
+import pgsolve_image
+import slcs2modalmu
+
+HOST = '127.0.0.1'
+PORT = 8765
+WORKERS = os.cpu_count() or 1 # jobs verified concurrently
+QUEUE_SIZE = 64 # jobs waiting for a worker before the server stops reading from clients
+CACHE_ENTRIES = 256 # translated formulae and specifications kept in memory each
+ENGINES = ['mcrl2', 'pgsolver', 'native']
+
+# Least recently used cache in memory, on_evict is called with every evicted value
+class Warm_Cache:
+    def __init__(self, max_entries = CACHE_ENTRIES, on_evict = None) -> None:
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+# Sets the module globals of the pipeline for a job, jobs with different options share the process
+def configure(greyscale, palette, encoding):
+    image2mcrl2.GREYSCALE = greyscale
+    image2mcrl2.PALETTE = palette
+    image2mcrl2.ENCODING = encoding
+    slcs2modalmu.GREYSCALE = greyscale
+    slcs2modalmu.MCRL2 = True
+
+# Kills a tool that is still running, e.g. when its job is cancelled because the client is gone
+async def stop_tool(process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError: # already exited
+            pass
+        await process.wait()
+
+async def run_tool(arguments):
+    process = await asyncio.create_subprocess_exec(*arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await process.wait()
+    finally:
+        await stop_tool(process)
+    if process.returncode != 0:
+        raise RuntimeError(f'{os.path.basename(arguments[0])} exited with code {process.returncode}')
+
+# Executes lps2pbes piped into pbessolve and parses the debug output while it is read, see pbessolve_image.Toolchain_Run
+async def run_pbessolve(lpsfile, mcffile, directory):
+    read, write = os.pipe()
+    processes = []
+    try:
+        try:
+            processes.append(await asyncio.create_subprocess_exec(pbessolve_image.mcrl2_tool('lps2pbes'), lpsfile, f'--formula={mcffile}',
+                                                                  stdout=write, stderr=subprocess.DEVNULL))
+            processes.append(await asyncio.create_subprocess_exec(
+                pbessolve_image.mcrl2_tool('pbessolve'), f'--file={os.path.realpath(lpsfile)}', '--verbose', '--debug',
+                stdin=read, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=directory))
+        finally: # the tools hold their own ends of the pipe
+            os.close(read)
+            os.close(write)
+        lps2pbes, process = processes
+        parser = pbessolve_image.Pbessolve_Output_Parser()
+        while True:
+            chunk = await process.stdout.read(pbessolve_image.CHUNK_SIZE)
+            if not chunk: # end of stream
+                parser.close()
+                break
+            if not parser.finished: # drain remaining output so pbessolve can finish writing the evidence
+                parser.feed(chunk)
+        if await lps2pbes.wait() != 0:
+            raise RuntimeError(f'lps2pbes exited with code {lps2pbes.returncode}')
+        if await process.wait() != 0:
+            raise RuntimeError(f'pbessolve exited with code {process.returncode}')
+    finally: # a cancelled job or a failing parser must not leave the tools running
+        for process in processes:
+            await stop_tool(process)
+    return pbessolve_image.extract_solutions(parser.get_equations())
+
+# Evaluates a job with the native engine, in a process of the pool of the server
+def evaluate_native(job, SLCS_Ast):
+    configure(job['greyscale'], job['palette'], job['encoding'])
+    return native_image.evaluate_tree(SLCS_Ast, native_image.load_pixels(job['image'], job['greyscale']))
+
+class Verification_Server:
+    def __init__(self, workdir, workers = WORKERS, queue_size = QUEUE_SIZE, cache_entries = CACHE_ENTRIES) -> None:
+        self.workdir = workdir
+        self.workers = workers
+        self.queue = asyncio.Queue(queue_size)
+        self.formulas = Warm_Cache(cache_entries) # maps formula and options to (AST, predicates, .mcf text)
+        self.specifications = Warm_Cache(cache_entries, self.evict_linearisation) # maps image and options to a task creating the .lps
+        self.evicted = set() # tasks of evicted specifications whose .lps is not removed yet
+        self.waiting = {} # maps tasks to the amount of jobs waiting to link their .lps
+        self.executor = None # process pool of the native engine, created by serve
+
+    # Translates the formula, or takes it from the cache, and writes its .mcf to the directory
+    def translate(self, job, directory):
+        with open(job['formula']) as file:
+            key = (file.read(), job['greyscale'], job['atoms'], job['optimize'], job['engine'] == 'native')
+        entry = self.formulas.get(key)
+        if entry is None:
+            configure(job['greyscale'], job['palette'], job['encoding'])
+            SLCS_Ast = slcs2modalmu.parse_SLCS_formula(job['formula'], job['greyscale'], True)
+            predicates = slcs2modalmu.collect_atomic_predicates(SLCS_Ast) if job['atoms'] else None
+            if job['engine'] == 'native':
+                entry = (slcs2modalmu.optimize_tree(SLCS_Ast) if job['optimize'] else SLCS_Ast, predicates, None)
+            else:
+                mcffile = slcs2modalmu.translate_SLCS_formula(job['formula'], job['greyscale'], True, predicates, job['optimize'], os.path.join(directory, 'formula'))
+                with open(mcffile) as file:
+                    entry = (SLCS_Ast, predicates, file.read())
+            self.formulas.put(key, entry)
+        elif entry[2] is not None:
+            with open(os.path.join(directory, 'formula.mcf'), 'w') as file:
+                file.write(entry[2])
+        return entry
+
+    # Generates the specification of the image and linearises it with mcrl22lps
+    async def linearise(self, job, predicates, lpsfile):
+        configure(job['greyscale'], job['palette'], job['encoding'])
+        propositions = native_image.proposition_masks(job['image'], predicates, job['greyscale']) if predicates else None
+        mcrl2file = lpsfile[:-4] + '.mcrl2'
+        with open(mcrl2file, 'w') as file:
+            image2mcrl2.write_mCRL2_spec(job['image'], file, propositions)
+        try:
+            await run_tool([pbessolve_image.mcrl2_tool('mcrl22lps'), mcrl2file, lpsfile])
+        finally:
+            os.remove(mcrl2file)
+        return lpsfile
+
+    # Removes the .lps of an evicted specification once mcrl22lps finished, also if it is evicted while running
+    def evict_linearisation(self, task):
+        self.evicted.add(task)
+        task.add_done_callback(self.remove_linearisation)
+
+    # Removes the .lps of an evicted task as soon as no job waits to link it, jobs using it hold a link of their own
+    def remove_linearisation(self, task):
+        if task not in self.evicted or self.waiting.get(task) or not task.done():
+            return
+        self.evicted.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            os.remove(task.result())
+
+    # Links the .lps of the image into the directory, sharing the linearisation of equal specifications
+    async def specification(self, job, predicates, directory):
+        predicate_keys = tuple(slcs2modalmu.proposition_key(predicate) for predicate in predicates) if predicates else None
+        key = artifact_cache.stage_key('lps', artifact_cache.hash_image(job['image']), job['greyscale'], job['palette'], job['encoding'], predicate_keys)
+        task = self.specifications.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.linearise(job, predicates, os.path.join(self.workdir, key + '.lps')))
+            self.specifications.put(key, task)
+        self.waiting[task] = self.waiting.get(task, 0) + 1
+        try:
+            try:
+                sharedfile = await asyncio.shield(task) # a cancelled job does not cancel the linearisation of other jobs
+            except Exception:
+                self.specifications.discard(key)
+                raise
+            lpsfile = os.path.join(directory, 'image.lps')
+            try:
+                os.link(sharedfile, lpsfile)
+            except OSError:
+                shutil.copyfile(sharedfile, lpsfile)
+        finally:
+            self.waiting[task] -= 1
+            if not self.waiting[task]:
+                del self.waiting[task]
+                self.remove_linearisation(task) # the task may be evicted while this job waited
+        return lpsfile
+
+    async def verify(self, job):
+        configure(job['greyscale'], job['palette'], job['encoding']) # the globals may be left by a job with other options
+        with tempfile.TemporaryDirectory(dir=self.workdir) as directory: # every job gets its own files
+            SLCS_Ast, predicates, _ = self.translate(job, directory)
+            if job['engine'] == 'native':
+                return await asyncio.get_running_loop().run_in_executor(self.executor, evaluate_native, job, SLCS_Ast)
+            lpsfile = await self.specification(job, predicates, directory)
+            mcffile = os.path.join(directory, 'formula.mcf')
+            if job['engine'] == 'pgsolver':
+                pbesfile = os.path.join(directory, 'formula.pbes')
+                await run_tool([pbessolve_image.mcrl2_tool('lps2pbes'), lpsfile, pbesfile, f'--formula={mcffile}'])
+                true_coords = await asyncio.get_running_loop().run_in_executor(None, pgsolve_image.solve_pbes, pbesfile)
+            else: # the .pbes is piped into pbessolve
+                true_coords = await run_pbessolve(lpsfile, mcffile, directory)
+        with Image.open(job['image']) as im:
+            return native_image.coords_to_mask(true_coords, (im.height, im.width))
+
+    # Verifies a job and saves its outputs, returns the result sent to the client
+    async def run_job(self, job):
+        start_time = timeit.default_timer()
+        mask = await self.verify(job)
+        result = {'id': job.get('id'), 'status': 'ok', 'pixels': int(np.count_nonzero(mask))}
+        base_imagefile = job['image'].rsplit('.', 1)[0] # only remove extension from image
+        basefile = f'{base_imagefile}_{os.path.basename(job["formula"]).rsplit(".", 1)[0]}'
+        if job['mark']:
+            with Image.open(job['image']) as im:
+                image_output.mark_image(im, mask, tuple(job['markcolour'])).save(basefile + '.png', 'PNG')
+            result['marked_image'] = basefile + '.png'
+        if job['export']:
+            result['exports'] = {format: image_output.save_mask(mask, basefile, format) for format in job['export']}
+        if job['coords']:
+            result['coords'] = native_image.mask_to_coords(mask)
+        result['seconds'] = timeit.default_timer() - start_time
+        return result
+
+    async def worker(self):
+        while True:
+            job, writer, done = await self.queue.get()
+            try:
+                result = await self.run_job(job)
+            except Exception as error:
+                result = {'id': job.get('id'), 'status': 'error', 'error': f'{type(error).__name__}: {error}'}
+            try:
+                writer.write(json.dumps(result).encode('utf-8') + b'\n')
+                await writer.drain()
+            except ConnectionError: # the client is gone, its remaining jobs are still verified
+                pass
+            finally:
+                done.set_result(result)
+                self.queue.task_done()
+
+    # Reads the jobs of a connection, waiting while the queue is full
+    async def handle_connection(self, reader, writer):
+        pending = []
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                job = read_job(json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                writer.write(json.dumps({'status': 'error', 'error': f'invalid job: {error}'}).encode('utf-8') + b'\n')
+                continue
+            done = asyncio.get_running_loop().create_future()
+            await self.queue.put((job, writer, done))
+            pending.append(done)
+        await asyncio.gather(*pending) # results of all jobs are written before the connection is closed
+        writer.close()
+
+    async def serve(self, host = HOST, port = PORT, socketfile = None):
+        self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn')) # forking the running event loop may deadlock
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if socketfile is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, socketfile)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'[verify_server]    serving on {socketfile or f"{host}:{port}"} with {self.workers} workers')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(cancel_futures=True)
+
+# Fills in the defaults of a job and checks its fields
+def read_job(job):
+    if not isinstance(job, dict):
+        raise ValueError('a job must be a JSON object')
+    if not isinstance(job.get('image'), str) or not isinstance(job.get('formula'), str):
+        raise ValueError('a job needs an image and a formula')
+    job = {'engine': 'mcrl2', 'greyscale': False, 'palette': False, 'encoding': 'list', 'atoms': False, 'optimize': False,
+           'markcolour': batch_image.MARK_COLOUR, 'mark': True, 'export': [], 'coords': False, **job}
+    if job['engine'] not in ENGINES:
+        raise ValueError(f'unknown engine {job["engine"]}')
+    if job['encoding'] not in image2mcrl2.ENCODINGS:
+        raise ValueError(f'unknown encoding {job["encoding"]}')
+    if any(format not in image_output.EXPORT_FORMATS for format in job['export']):
+        raise ValueError(f'unknown export format in {job["export"]}')
+    return job
+
+# Sends jobs to a running server, yields the results in order of completion
+def submit(jobs, host = HOST, port = PORT, socketfile = None):
+    if socketfile is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socketfile)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile('rwb') as stream:
+        for job in jobs:
+            stream.write(json.dumps(job).encode('utf-8') + b'\n')
+        stream.flush()
+        connection.shutdown(socket.SHUT_WR)
+        for line in stream:
+            yield json.loads(line)
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help = "address to listen on or to connect to", default = HOST)
+    parser.add_argument("--port", help = "port to listen on or to connect to", type = int, default = PORT)
+    parser.add_argument("--socket", help = "use a Unix domain socket at this path instead of TCP")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    serve_parser = subparsers.add_parser("serve", help = "run the verification server")
+    serve_parser.add_argument("--workers", help = "amount of jobs verified concurrently", type = int, default = WORKERS)
+    serve_parser.add_argument("--queuesize", help = "amount of jobs waiting for a worker before the server stops reading", type = int, default = QUEUE_SIZE)
+    serve_parser.add_argument("--cacheentries", help = "amount of translated formulae and specifications kept in memory", type = int, default = CACHE_ENTRIES)
+    serve_parser.add_argument("--workdir", help = "directory of the files of the jobs, defaults to a temporary directory (on tmpfs if available)", default = pbessolve_image.SCRATCH_DIR)
+    submit_parser = subparsers.add_parser("submit", help = "verify a formula on images with a running server")
+    submit_parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format")
+    submit_parser.add_argument("images", help = "the images to be checked, one job per image", nargs = '+')
+    submit_parser.add_argument("--engine", help = "engine verifying the formula", choices = ENGINES, default = 'mcrl2')
+    submit_parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    submit_parser.add_argument("--atoms", help = "evaluate atomic propositions in Python, see verify_image", action = "store_true")
+    submit_parser.add_argument("--optimize", help = "share common subformulae and simplify the formula", action = "store_true")
+    submit_parser.add_argument("--export", help = "also save the satisfying pixels in compact formats, see image_output", nargs = '+', choices = image_output.EXPORT_FORMATS, default = [])
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        with tempfile.TemporaryDirectory(dir = args.workdir) as workdir:
+            server = Verification_Server(workdir, args.workers, args.queuesize, args.cacheentries)
+            try:
+                asyncio.run(server.serve(args.host, args.port, args.socket))
+            except KeyboardInterrupt:
+                print('[verify_server]    stopped')
+    else:
+        jobs = [{'id': index, 'image': os.path.abspath(image), 'formula': os.path.abspath(args.slcsformula), 'engine': args.engine,
+                 'greyscale': args.greyscale, 'atoms': args.atoms, 'optimize': args.optimize, 'export': args.export}
+                for index, image in enumerate(args.images)]
+        for result in submit(jobs, args.host, args.port, args.socket):
+            print(json.dumps(result))
@@ -0,0 +1,205 @@
+'''
+volume_image
+Verifies a SLCS formula on a volume, a directory of slices or a multi-page image (e.g. TIFF)
+
+The volume is modelled as Grid(x, y, z) with R moves to the 6 neighbours of a voxel,
+so S checks whether a region is enclosed in 3D rather than within a single slice.
+The slices are read as a stream and the specification is written slice by slice,
+one equation row(y, z) per row of voxels, so only one slice is in memory at a time.
+With precomputed atomic propositions, every voxel is encoded by a single number whose
+i-th bit states whether proposition ap_i holds, so no table of valuations is needed.
+The satisfying voxels are returned as 3D mask of shape (depth, height, width),
+which is saved as [PATH_VOLUME]_[FORMULA].npy.
+
+For input arguments, see also the help file invoked by setting the -h flag.
+'''
+import argparse
+import os
+import numpy as np
+from PIL import Image, ImageSequence
+
+# other scripts
+import image2mcrl2
+import native_image
+import pbessolve_image
+import slcs2modalmu
+
+SLICE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'tif', 'tiff') # slices in a directory
+VOLUME_EXTENSIONS = ('tif', 'tiff', 'gif') # multi-page images
+
+# Yields the pixel values of the slices of a volume one by one, in order of z
+def iter_slices(source, greyscale):
+    if os.path.isdir(source):
+        for file in sorted(os.listdir(source)):
+            if file.rsplit('.', 1)[-1].lower() in SLICE_EXTENSIONS:
+                yield native_image.load_pixels(os.path.join(source, file), greyscale)
+    else:
+        with Image.open(source) as im:
+            for frame in ImageSequence.Iterator(im):
+                yield native_image.image_pixels(frame, greyscale)
+
+# Encodes the valuation of the propositions in every voxel of a slice as a bitmask
+def proposition_codes(pixels, predicates):
+    codes = np.zeros(pixels.shape[:-1], dtype=np.int64)
+    for bit, predicate in enumerate(predicates):
+        if not predicate.is_leaf(): # would depend on the neighbouring slices
+            raise ValueError(f'Operator \'{predicate.value}\' is not supported for volumes')
+        codes |= native_image.atom_mask(pixels, predicate.value).astype(np.int64) << bit
+    return codes
+
+# Writes the .mcrl2 specification of the volume to a file, streaming the slices
+# if predicates are given, voxels report actions ap_0, ap_1, ... instead of their value
+# returns the (depth, height, width) shape of the volume
+def write_mCRL2_volume_spec(slices, file, predicates = None):
+    value_sort = 'Nat' if predicates else 'Pixel'
+    if image2mcrl2.GREYSCALE and not predicates:
+        file.write(f'''sort\n\tPixel = Int;\n''')
+    elif not predicates:
+        file.write(f'''sort\n\tPixel = struct RGB(
+		    red:Intensity,
+		    green:Intensity,
+		    blue:Intensity
+	    );
+	    \tIntensity = Int;\n''')
+    file.write(f'''\nmap
+	row: Nat # Nat -> List({value_sort});''')
+    if predicates: # holds(i, c) states whether bit i of voxel code c is set
+        file.write(f'''
+	holds: Nat # Nat -> Bool;''')
+    file.write(f'''
+	start_x, start_y, start_z: Nat;
+	size_x,	size_y, size_z: Nat;
+    ''')
+    if predicates:
+        file.write(f'''
+var
+    i, c: Nat;
+eqn
+    holds(i, c) = (c div exp(2, i)) mod 2 == 1;
+    ''')
+
+    file.write(f'''
+eqn ''')
+    depth = 0
+    for z, pixels in enumerate(slices): # one slice in memory at a time
+        if depth > 0 and pixels.shape[:2] != (height, width):
+            raise ValueError(f'slice {z} has size {pixels.shape[1]}x{pixels.shape[0]}, expected {width}x{height} like the first slice')
+        if predicates:
+            rows = image2mcrl2.index_rows(proposition_codes(pixels, predicates))
+        else:
+            rows = image2mcrl2.pixel_rows(pixels)
+        for y, row in enumerate(rows):
+            file.write(f'''
+    row({y}, {z}) = [{', '.join(row)}];''')
+        height, width = pixels.shape[:2]
+        depth += 1
+    if depth == 0:
+        raise ValueError('volume does not contain any slices')
+    file.write(f'''
+    start_x = 0;
+    start_y = 0;
+    start_z = 0;
+    size_x = {width - 1};
+    size_y = {height - 1};
+    size_z = {depth - 1};''')
+
+    if predicates:
+        actions = ', '.join(['R'] + [f'ap_{proposition}' for proposition in range(len(predicates))])
+        reports = ''.join(f'''
+    + holds({proposition}, row(y, z).x) -> ap_{proposition} . Grid(x,y,z) ''' for proposition in range(len(predicates)))
+        file.write(f'''
+act
+    {actions};
+proc
+Grid(x:Nat, y: Nat, z: Nat) =
+    R . Grid(x,y,z) {reports}''')
+    else:
+        actions = 'R, report'
+        file.write(f'''
+act
+    R;
+    report: Pixel;
+proc
+Grid(x:Nat, y: Nat, z: Nat) =
+    report(row(y, z).x) . Grid(x,y,z)
+    + R . Grid(x,y,z) ''')
+    file.write(f'''
+    + (x != 0) 		-> R . Grid(Int2Nat(x-1), y, z)
+    + (x != size_x)	-> R . Grid(Int2Nat(x+1), y, z)
+    + (y != 0) 		-> R . Grid(x, Int2Nat(y-1), z)
+    + (y != size_y) -> R . Grid(x, Int2Nat(y+1), z)
+    + (z != 0) 		-> R . Grid(x, y, Int2Nat(z-1))
+    + (z != size_z) -> R . Grid(x, y, Int2Nat(z+1))
+;
+init
+    allow ({{{actions}}},
+    comm(
+        {{}}, Grid(start_x, start_y, start_z)
+    )
+);''') # double braces to escape { } characters in f-string
+    return depth, height, width
+
+def base_volumefile(source):
+    if os.path.isdir(source):
+        return source.rstrip('/\\')
+    return source.rsplit('.', 1)[0] # remove extension
+
+def create_mcrl2_volume_specification(source, greyscale, predicates = None):
+    if greyscale:
+        image2mcrl2.GREYSCALE = True
+    mcrl2specfile = base_volumefile(source) + '.mcrl2'
+    with open(mcrl2specfile, "w") as file: # stream the spec to file
+        shape = write_mCRL2_volume_spec(iter_slices(source, greyscale), file, predicates)
+
+    print(f'[volume_image]    successfully saved mcrl2 specification of {source} to {mcrl2specfile}')
+
+    return mcrl2specfile, shape
+
+# Converts a list of (x, y, z) coordinates to a mask with the given (depth, height, width) shape
+def coords_to_volume(coords, shape):
+    mask = np.zeros(shape, dtype=bool)
+    if coords:
+        xs, ys, zs = zip(*coords)
+        mask[list(zs), list(ys), list(xs)] = True
+    return mask
+
+def do_volume(source, SLCSformula, greyscale, engine = 'mcrl2', atoms = False, optimize = False):
+    SLCS_Ast = slcs2modalmu.parse_SLCS_formula(SLCSformula, greyscale, True) # atomic propositions in mcrl2 format
+    if engine == 'native': # the native engine works on masks of any dimension
+        if optimize:
+            SLCS_Ast = slcs2modalmu.optimize_tree(SLCS_Ast)
+        mask = native_image.evaluate_tree(SLCS_Ast, np.stack(list(iter_slices(source, greyscale))))
+    else:
+        predicates = slcs2modalmu.collect_atomic_predicates(SLCS_Ast) if atoms else None
+        mcrl2file, shape = create_mcrl2_volume_specification(source, greyscale, predicates)
+        mcffile = slcs2modalmu.translate_SLCS_formula(SLCSformula, greyscale, True, predicates, optimize)
+        mask = coords_to_volume(pbessolve_image.do_pbessolve(mcrl2file, mcffile), shape)
+
+    maskfile = f'{base_volumefile(source)}_{os.path.basename(SLCSformula).rsplit(".", 1)[0]}.npy'
+    np.save(maskfile, mask)
+    print(f'[volume_image]    {np.count_nonzero(mask)} voxels satisfy {SLCSformula}, saved mask to {maskfile}')
+
+    return mask
+
+def check_extension(extension, file):
+    if not file.endswith(extension):
+        raise argparse.ArgumentTypeError(f'incorrect extension, expected {extension}')
+    return file
+
+def check_volume(source):
+    if not os.path.isdir(source) and source.rsplit('.', 1)[-1].lower() not in VOLUME_EXTENSIONS:
+         raise argparse.ArgumentTypeError(f'expected a directory of slices or a multi-page image, allowed formats: {", ".join(VOLUME_EXTENSIONS)}')
+    return source
+
+if __name__ == '__main__':
+    # handle argument parsing and save args to list
+    parser = argparse.ArgumentParser()
+    parser.add_argument("volume", help = "a directory of slices, ordered by file name, or a multi-page image", type=check_volume)
+    parser.add_argument("slcsformula", help = "the spatial logic formula, in .slcs format", type=lambda f: check_extension('.slcs', f))
+    parser.add_argument("--greyscale", help = "optimization for monochromatic images", action = "store_true")
+    parser.add_argument("--engine", help = "verify with the mCRL2 toolset or with the native (NumPy) engine", choices = ['mcrl2', 'native'], default = 'mcrl2')
+    parser.add_argument("--atoms", help = "evaluate atomic propositions in Python and report them as actions ap_i in the mcrl2 specification", action = "store_true")
+    parser.add_argument("--optimize", help = "share common subformulae and simplify the formula before translating it", action = "store_true")
+    args = parser.parse_args()
+
+    mask = do_volume(args.volume, args.slcsformula, args.greyscale, args.engine, args.atoms, args.optimize)